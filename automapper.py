@@ -18,7 +18,9 @@
 #    ~/.config/MusicBrainz/Picard/plugins
 # =============================================================================================
 
-import re
+import os, re, hashlib
+from time import time, perf_counter
+from functools import partial
 
 
 
@@ -31,18 +33,26 @@ PLUGIN_LICENSE = 'GPLv3'
 PLUGIN_LICENSE_URL = 'https://www.gnu.org/licenses/gpl-3.0.en.html'
 
 from PyQt5 import QtWidgets
-from picard.config import BoolOption
+from picard.config import BoolOption, TextOption
 from picard import config, log
 from picard.file import File, register_file_post_addition_to_track_processor, register_file_post_load_processor, register_file_post_save_processor
 from picard.metadata import register_track_metadata_processor
 from picard.plugin import PluginPriority
 from picard.track import Track
 from picard.ui.options import OptionsPage, register_options_page
+from picard.plugins.metapicardcommon import AuditTrail, FingerprintIndex, Profiler, fileKeyForms, keyForms, vendorKey
+
+
+
+_profiler = Profiler(PLUGIN_NAME)
 
 
 
 class AutoMapper():
 
+    _fingerprints = FingerprintIndex(PLUGIN_NAME, PLUGIN_VERSION, ( r'purgeUnmapped', r'mergeNormalizedValues', r'autoMapperRules',
+                                                     r'clear_existing_tags', r'preserved_tags', ))
+
     _standardKeys = { r'writer', r'work', r'website', r'titlesort', r'title', r'tracknumber',
                       r'totaltracks', r'totaldiscs', r'subtitle', r'showmovement', r'showsort',
                       r'show', r'script', r'replaygain_track_range', r'replaygain_track_peak',
@@ -103,8 +113,8 @@ class AutoMapper():
                  r'iplsmix': r'mixer', r'tipldjmix': r'djmixer', r'iplsdjmix': r'djmixer',
                  r'tmed': r'media', r'imed': r'media', r'releaseformat': r'media',
                  r'albumformat': r'media', r'physicalformat': r'media', r'medium': r'media',
-                 r'physicalmedium': r'media', r'releasemedia': r'media', r'releaseformat': r'media',
-                 r'releasemedium': r'media', r'lyr': r'lyrics', r'lyrist': r'lyricist',
+                 r'physicalmedium': r'media', r'releasemedia': r'media', r'releasemedium': r'media',
+                 r'lyr': r'lyrics', r'lyrist': r'lyricist',
                  r'lyricsartist': r'lyricist', r'wcop': r'license', r'licenseurl': r'license',
                  r'ilng': r'language', r'tlan': r'language', r'lang': r'language', r'tsrc': r'isrc',
                  r'initialkey': r'key', r'tkey': r'key', r'songkey': r'key', r'grp': r'grouping',
@@ -120,13 +130,12 @@ class AutoMapper():
                  r'codecsettings': r'encodersettings', r'encodingparams': r'encodersettings',
                  r'encodingparameters': r'encodersettings', r'encoderparams': r'encodersettings',
                  r'encoderparameters': r'encodersettings', r'codecparams': r'encodersettings',
-                 r'encoderparameters': r'encodersettings', r'software': r'encodedby',
-                 r'encoder': r'encodedby', r'tenc': r'encodedby', r'too': r'encodedby',
-                 r'ienc': r'encodedby', r'source': r'encodedby', r'ripped': r'encodedby',
+                 r'software': r'encodedby', r'encoder': r'encodedby', r'tenc': r'encodedby',
+                 r'too': r'encodedby', r'ienc': r'encodedby', r'ripped': r'encodedby',
                  r'rippedby': r'encodedby', r'generatedby': r'encodedby', r'tsst': r'discsubtitle',
-                 r'disksubtitle': r'discsubtitle', r'disks': r'totaldiscs', r'dir': r'director',
+                 r'disksubtitle': r'discsubtitle', r'dir': r'director',
                  r'disktitle': r'discsubtitle', r'disctitle': r'discsubtitle', r'tpe3': r'conductor',
-                 r'setsubtitle': r'discsubtitle', r'settitle': r'discsubtitle', r'imus': r'composer',
+                 r'setsubtitle': r'discsubtitle', r'imus': r'composer',
                  r'directedby': r'director', r'copyrights': r'copyright', r'copy': r'copyright',
                  r'tcop': r'copyright', r'cprt': r'copyright', r'icop': r'copyright',
                  r'conductedby': r'conductor', r'conduction': r'conductor', r'soco': r'composersort',
@@ -176,7 +185,7 @@ class AutoMapper():
                  r'originator': r'encodedby', r'discogs_artist_name': r'artist', r'discogs_date': r'date',
                  r'discogs_catalog': r'catalognumber', r'discogs_country': r'releasecountry',
                  r'discogs_discid': r'discid', r'text': r'lyricist', r'my comment': r'comment',
-                 r'tmoo': r'mood', r'unsyncedlyrics': r'lyrics', }
+                 r'unsyncedlyrics': r'lyrics', }
 
     _splitfulMapping = { r'trkn':       (r'tracknumber', r'totaltracks'),
                          r'trck':       (r'tracknumber', r'totaltracks'),
@@ -191,40 +200,201 @@ class AutoMapper():
                          r'partofset':  (r'discnumber',  r'totaldiscs'),
                          r'mvin':       (r'movementnumber', r'movementtotal'), }
 
+    _KEEP, _MOVE, _SPLIT = 0, 1, 2
+
+    _lyricsKey = re.compile(r'^(.*\W)?lyrics\W.*$', re.IGNORECASE)
+    _splittable = re.compile(r'^\W*([0-9]+)(\W([0-9]+))?\W*$')
+    _spaces = re.compile(r'\s+')
+
+    _ruleKinds = {r'exact', r'prefix', r'regex', r'split'}
+    _rule = re.compile(r'^(\w+)\s+(.+?)\s*=\s*(.+)$')
+    _rulesStamp = None
+    _rulesDigest = None
+    _rulesCheckedAt = 0
+    _rulesCheckInterval = 5
+
+    _compiled = ({}, None, {}, [])
+    _decisionMemo = {}
+    _decisionMemoLimit = 8192
+    _planMemo = {}
+    _planMemoLimit = 1024
+    _auditTrail = None
+
 
     def __init__( self ):
         super().__init__()
 
-    def _list( self, value ):
-        if (type(value) == list): return value
-        else: return [value]
-
-    def _moveTagValue( self, value, to, metadata, toBeCreated=None ):
-        value = re.sub(r'\s+', r' ', value.strip())
-        if (not metadata.get(to, r'')):
-            if (toBeCreated): toBeCreated[to] = self._list(value)
-            else: metadata[to] = self._list(value)
-        elif (value not in metadata[to]):
-            if (type(metadata[to]) == list):
-                metadata[to] += self._list(value)
-            else:
-                metadata[to] = [metadata[to]] + self._list(value)
-
-    def _moveSplittableTag( self, value, to, metadata, toBeCreate=None ):
-        pattern = re.compile(r'^\W*([0-9]+)(\W([0-9]+))?\W*$')
-        value1 = pattern.search(value).group(1)
-        value2 = pattern.search(value).group(3)
-        self._moveTagValue(value1, to[0], metadata, toBeCreated)
-        if (not tag2): return
-        self._moveTagValue(value2, to[1], metadata, toBeCreated)
-
-    def _mapLyrics( self, metadata, toBeDeleted, keepLyrics, toBeKept ):
+    @classmethod
+    def _builtinDecisionTable( cls ):
+        table = {key: (cls._MOVE, key) for key in cls._standardKeys}
+        table.update({key: (cls._MOVE, target) for key, target in cls._mapping.items()})
+        table.update({key: (cls._SPLIT, targets) for key, targets in cls._splitfulMapping.items()})
+        return table
+
+    @classmethod
+    def _loadRules( cls, path ):
+        exact, prefixes, regexes, samples = {}, {}, [], []
+        builtin = cls._builtinDecisionTable()
+        knownTargets = cls._standardKeys | set(cls._mapping.values())
+        try:
+            with open(path, r'r', encoding=r'utf-8') as rulesFile: lines = rulesFile.readlines()
+        except OSError as e:
+            log.warning(r'{}: cannot read mapping rules from "{}": {}'.format(PLUGIN_NAME, path, e))
+            return (exact, prefixes, regexes, samples)
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if ((not line) or line.startswith(r'#')): continue
+            where = r'{}: {}:{}: '.format(PLUGIN_NAME, path, number)
+            rule = cls._rule.match(line)
+            if ((not rule) or (rule.group(1).casefold() not in cls._ruleKinds)):
+                log.warning(where + r'ignoring invalid rule "{}"'.format(line))
+                continue
+            kind, key = rule.group(1).casefold(), rule.group(2)
+            targets = tuple(target.strip() for target in rule.group(3).split(r','))
+            if ((not all(targets)) or (len(targets) != (2 if (kind == r'split') else 1))):
+                log.warning(where + r'ignoring rule with invalid target(s) "{}"'.format(rule.group(3)))
+                continue
+            for target in targets:
+                if (target not in knownTargets): log.warning(where + r'"{}" is not a standard tag'.format(target))
+            decision = (cls._SPLIT, targets) if (kind == r'split') else (cls._MOVE, targets[0])
+            if (kind == r'regex'):
+                try: regexes += [(re.compile(key, re.IGNORECASE), decision)]
+                except re.error as e: log.warning(where + r'ignoring invalid regex "{}": {}'.format(key, e))
+                continue
+            sample = (key + r'x') if (kind == r'prefix') else key # a tag the rule should decide
+            key = vendorKey(keyForms(key))
+            if (not key):
+                log.warning(where + r'ignoring rule with empty key')
+                continue
+            samples += [(where, sample, ((r'prefix:' + key) if (kind == r'prefix') else key))]
+            rules = prefixes if (kind == r'prefix') else exact
+            if (key in rules):
+                if (rules[key] != decision):
+                    log.warning(where + r'conflicting duplicate rule for "{}" overrides the previous one'.format(key))
+                else:
+                    log.warning(where + r'duplicate rule for "{}"'.format(key))
+            elif ((kind != r'prefix') and (builtin.get(key, decision) != decision)):
+                log.warning(where + r'rule for "{}" overrides the built-in mapping'.format(key))
+            rules[key] = decision
+        return (exact, prefixes, regexes, samples)
+
+    # warns about rules that cannot change any decision (e.g. for standard tags, or shadowed by other rules)
+    @classmethod
+    def _checkRules( cls, samples ):
+        decider = cls()
+        for where, sample, rule in samples:
+            decidedBy = decider._decide(sample, keyForms(sample))[3]
+            if ((decidedBy != rule) and (decider._decide(r'TXXX:' + sample, keyForms(r'TXXX:' + sample))[3] != rule)):
+                log.warning(where + r'rule "{}" has no effect: "{}" is {}'.format(rule, sample,
+                            ((r'decided by "' + decidedBy + r'"') if decidedBy else r'a standard tag')))
+
+    @classmethod
+    def _compileDecisionTable( cls, rules=None ):
+        table = cls._builtinDecisionTable()
+        exact, prefixes, regexes = rules[:3] if rules else ({}, {}, [])
+        table.update(exact)
+        prefixRules = None
+        if (prefixes):
+            alternatives = r'|'.join(re.escape(prefix) for prefix in sorted(prefixes, key=len, reverse=True))
+            prefixRules = re.compile(r'^(' + alternatives + r')')
+        cls._compiled = (table, prefixRules, prefixes, regexes)
+        rulesInEffect = (sorted(exact.items()), sorted(prefixes.items()), [(pattern.pattern, decision) for pattern, decision in regexes])
+        cls._rulesDigest = hashlib.blake2b(repr(rulesInEffect).encode(r'utf-8'), digest_size=16).hexdigest()
+        cls._decisionMemo = {}
+        cls._planMemo = {}
+
+    @classmethod
+    def _refreshRules( cls, force=False ):
+        now = time()
+        if ((not force) and (now < (cls._rulesCheckedAt + cls._rulesCheckInterval))): return
+        cls._rulesCheckedAt = now
+        path = config.setting[r'autoMapperRules'].strip()
+        try: stamp = (path, os.path.getmtime(path)) if path else None
+        except OSError: stamp = (path, None)
+        if ((stamp == cls._rulesStamp) and (not force)): return
+        cls._rulesStamp = stamp
+        rules = cls._loadRules(path) if path else None
+        cls._compileDecisionTable(rules)
+        if (not path): return
+        cls._checkRules(rules[3])
+        log.info(r'{}: mapping rules loaded from "{}"'.format(PLUGIN_NAME, path))
+
+    @classmethod
+    def _ruleNames( cls ):
+        table, prefixRules, prefixes, regexes = cls._compiled
+        return ([r'lyrics'] + list(table) + [(r'prefix:' + prefix) for prefix in prefixes] +
+                [(r'regex:' + pattern.pattern) for pattern, rule in regexes])
+
+    @classmethod
+    def _audit( cls ):
+        if (not config.setting[r'auditAutoMapper']): return None
+        if (cls._auditTrail is None): cls._auditTrail = AuditTrail(PLUGIN_NAME, cls._ruleNames)
+        return cls._auditTrail
+
+    def _decide( self, key, forms ):
+        isLyrics = bool(self._lyricsKey.match(key))
+        if (key in self._standardKeys): return (self._KEEP, None, isLyrics, None)
+        normkey, flatkey = forms[1:3]
+        if (normkey in self._standardKeys): return (self._MOVE, normkey, isLyrics, normkey)
+        table, prefixRules, prefixes, regexes = self._compiled
+        vendorkey = vendorKey(forms)
+        decision, rule = table.get(vendorkey, None), vendorkey
+        if (decision is None): decision, rule = table.get(flatkey, None), flatkey
+        if ((decision is None) and prefixRules):
+            prefix = prefixRules.match(vendorkey) or prefixRules.match(flatkey)
+            if (prefix): decision, rule = prefixes[prefix.group(1)], (r'prefix:' + prefix.group(1))
+        if (decision is None):
+            decision, rule = next(((decision, (r'regex:' + pattern.pattern)) for pattern, decision in regexes
+                                   if pattern.search(key)), ((self._KEEP, None), None))
+        action, target = decision
+        if ((action == self._MOVE) and (target == key)): action = self._KEEP
+        return (action, target, isLyrics, rule)
+
+    def _decision( self, key, forms ):
+        decision = self._decisionMemo.get(key, None)
+        if (decision is None):
+            if (len(self._decisionMemo) >= self._decisionMemoLimit): self._decisionMemo.clear()
+            decision = self._decide(key, forms)
+            self._decisionMemo[key] = decision
+        return decision
+
+    def _plan( self, metadata, f ):
+        plan = {}
+        for key, forms in fileKeyForms(metadata, f).items():
+            decision = self._decision(key, forms)
+            if ((decision[0] != self._KEEP) or decision[2]): plan[key] = decision
+        return plan
+
+    def _comparable( self, value, normalized ):
+        value = self._spaces.sub(r' ', value.strip())
+        return value.casefold() if normalized else value
+
+    def _mergeValues( self, values, to, metadata, merged, normalized ):
+        if (to not in merged):
+            existing = [value for value in metadata.getall(to) if value]
+            merged[to] = (existing, {self._comparable(value, normalized) for value in existing})
+        targetValues, seen = merged[to]
+        for value in values:
+            value = self._spaces.sub(r' ', value.strip())
+            comparable = value.casefold() if normalized else value
+            if ((not value) or (comparable in seen)): continue
+            seen.add(comparable)
+            targetValues += [value]
+
+    def _mergeSplittableValues( self, values, to, metadata, merged, normalized ):
+        parts = [self._splittable.search(value) for value in values]
+        if (not all(parts)): return False
+        self._mergeValues([part.group(1) for part in parts], to[0], metadata, merged, normalized)
+        self._mergeValues([part.group(3) for part in parts if part.group(3)], to[1], metadata, merged, normalized)
+        return True
+
+    def _mapLyrics( self, metadata, lyricsTags, mergedLyrics, toBeDeleted, keepLyrics, toBeKept ):
         foundLyrics = metadata.get(r'lyrics', r'')
         foundLyrics = [] if (not foundLyrics) else [foundLyrics]
-        for key in metadata:
-            if (re.match(r'^(.*\W)?lyrics\W.*$', key, flags=re.IGNORECASE)):
-                if (len(metadata[key])): foundLyrics += [metadata[key]]
-                toBeDeleted += [key]
+        foundLyrics += mergedLyrics
+        for key in lyricsTags:
+            if (len(metadata[key])): foundLyrics += [metadata[key]]
+            toBeDeleted += [key]
         if (foundLyrics):
             lyrics = sorted(foundLyrics, key=lambda x: len(re.sub(r'\W', r'', x)), reverse=True)[0]
             if (lyrics != metadata.get(r'lyrics', r'')):
@@ -232,34 +402,39 @@ class AutoMapper():
                 if (keepLyrics): toBeKept += [r'lyrics']
 
     def process( self, album, metadata, track, release, f=None ):
+        audit = self._audit()
+        if (audit):
+            startedAt, sizeBefore, keysBefore = perf_counter(), audit.size(metadata), list(metadata)
+            hits = {}
         toBeDeleted = []
-        toBeCreated = {}
         toBeKept = []
+        merged = {}
         keptTags = config.setting[r'preserved_tags']
-        for key, _ in list(metadata.items()):
-            if (key in self._standardKeys): continue
-            normkey = re.sub(r'[^\w_]', r'', re.sub(r'[\s:/_-]+', r'_', key.casefold()))
-            normkey = re.sub(r'^\W*(wm|txxx|((com\W*)?apple\W*)?itunes|lastfm)\W*', r'', normkey)
-            if (normkey in self._standardKeys):
+        normalized = config.setting[r'mergeNormalizedValues']
+        lyricsTags = []
+        self._refreshRules()
+        signature = (frozenset(metadata), self._rulesStamp)
+        plan = self._planMemo.get(signature, None)
+        if (plan is None):
+            if (len(self._planMemo) >= self._planMemoLimit): self._planMemo.clear()
+            plan = self._plan(metadata, f)
+            self._planMemo[signature] = plan
+        for key in [key for key in metadata if (key in plan)]:
+            action, target, isLyrics, rule = plan[key]
+            if (isLyrics): lyricsTags += [key]
+            if (action == self._MOVE):
                 toBeDeleted += [key]
-                if (normkey in keptTags): toBeKept += [normkey]
-                self._moveTagValue(metadata[key], normkey, metadata, toBeCreated)
-            else:
-                normkey = re.sub(r'[_~]', r'', normkey)
-                if (normkey in self._splitfulMapping):
-                    toBeDeleted += [key]
-                    partTags = self._splitfulMapping[normkey]
-                    if (partTags[1] in keptTags): toBeKept += [partTags[1]]
-                    if (partTags[1] in keptTags): toBeKept += [partTags[1]]
-                    self._moveSplittableTag(metadata[key], partTags, metadata, toBeCreated)
-                standardTag = self._mapping.get(normkey, r'')
-                if ((not standardTag) and (normkey in self._standardKeys)): standardTag = normkey
-                if ((len(standardTag)) and (standardTag != key)):
-                    toBeDeleted += [key]
-                    if (standardTag in keptTags): toBeKept += [standardTag]
-                    self._moveTagValue(metadata[key], standardTag, metadata, toBeCreated)
-        self._mapLyrics(metadata, toBeDeleted, (r'lyrics' in keptTags), toBeKept)
-        for tagName, value in toBeCreated.items(): metadata[tagName] = value
+                if (target in keptTags): toBeKept += [target]
+                self._mergeValues(metadata.getall(key), target, metadata, merged, normalized)
+            elif (action == self._SPLIT):
+                if (not self._mergeSplittableValues(metadata.getall(key), target, metadata, merged, normalized)): continue
+                toBeDeleted += [key]
+                toBeKept += [tagName for tagName in target if (tagName in keptTags)]
+            if (audit): hits[rule or r'lyrics'] = hits.get(rule or r'lyrics', 0) + 1
+        mergedLyrics = merged.pop(r'lyrics', ([], None))[0]
+        self._mapLyrics(metadata, lyricsTags, mergedLyrics, toBeDeleted, (r'lyrics' in keptTags), toBeKept)
+        for tagName, (values, _) in merged.items():
+            if (values): metadata[tagName] = values
         if (config.setting[r'purgeUnmapped']):
             for tagName in metadata:
                 if (tagName not in self._standardKeys): toBeDeleted += [tagName]
@@ -269,6 +444,7 @@ class AutoMapper():
             toBeKept = list(set(toBeKept))
             for tagName in toBeKept: f.preservedMappedMetadata[tagName] = metadata[tagName]
         for tagName in toBeDeleted: metadata.pop(tagName, None)
+        if (audit): audit.record((perf_counter() - startedAt), hits, sizeBefore, keysBefore, metadata)
 
     def _restorePreservedMetadata( self, file ):
         if (not config.setting[r'clear_existing_tags']): return
@@ -279,12 +455,20 @@ class AutoMapper():
             if (tagName not in file.metadata):
                 file.metadata[tagName] = file.preservedMappedMetadata[tagName]
 
+    # replaying a change-set would neither feed the audit trail nor keep the preserved tags aside; the
+    # rules in effect are part of the fingerprint, so a change-set recorded under other rules is not replayed
+    def _processFile( self, hook, track, file ):
+        process = partial(self.process, None, file.metadata, track, None, file)
+        if (self._audit() or config.setting[r'clear_existing_tags']): return process()
+        self._refreshRules()
+        self._fingerprints.run(hook, file, process, self._rulesDigest)
+
     def processFile( self, track, file ):
         self._restorePreservedMetadata(file)
-        self.process(None, file.metadata, track, None, file)
+        self._processFile(r'file_post_addition_to_track', track, file)
 
     def processFileOnLoad( self, file ):
-        self.process(None, file.metadata, None, None, file)
+        self._processFile(r'file_post_load', None, file)
 
     def processFileAfterSaving( self, file ):
         if (r'preservedMappedMetadata' in dir(file)):
@@ -292,13 +476,20 @@ class AutoMapper():
 
 
 
+AutoMapper._compileDecisionTable()
+
+
+
 class AutoMapperOptionsPage( OptionsPage ):
 
     NAME = PLUGIN_NAME.casefold()
     TITLE = r'Non-standard Tags Mapping'
     PARENT = r'tags' # r'plugins' ?
 
-    options = [ BoolOption(r'setting', r'purgeUnmapped', False) ]
+    options = [ BoolOption(r'setting', r'purgeUnmapped', False),
+                BoolOption(r'setting', r'mergeNormalizedValues', False),
+                TextOption(r'setting', r'autoMapperRules', r''),
+                BoolOption(r'setting', r'auditAutoMapper', False) ]
 
     def __init__( self, parent=None ):
         super().__init__(parent)
@@ -308,19 +499,41 @@ class AutoMapperOptionsPage( OptionsPage ):
         self.purgeUnmapped.setChecked(False)
         self.purgeUnmapped.setText(r'Purge non-standard tags left unmapped')
         self.box.addWidget(self.purgeUnmapped)
+        self.mergeNormalizedValues = QtWidgets.QCheckBox(self)
+        self.mergeNormalizedValues.setCheckable(True)
+        self.mergeNormalizedValues.setChecked(False)
+        self.mergeNormalizedValues.setText(r'Ignore letter case when merging values into the same tag')
+        self.box.addWidget(self.mergeNormalizedValues)
+        self.rulesLabel = QtWidgets.QLabel(self)
+        self.rulesLabel.setText(r'Custom mapping rules file (one "exact|prefix|regex|split KEY = TAG[, TAG]" per line)')
+        self.box.addWidget(self.rulesLabel)
+        self.rulesInput = QtWidgets.QLineEdit(self)
+        self.box.addWidget(self.rulesInput)
+        self.auditAutoMapper = QtWidgets.QCheckBox(self)
+        self.auditAutoMapper.setCheckable(True)
+        self.auditAutoMapper.setChecked(False)
+        self.auditAutoMapper.setText(r'Keep an audit trail of the mappings done (in the cache directory)')
+        self.box.addWidget(self.auditAutoMapper)
         self.spacer = QtWidgets.QSpacerItem(0, 0, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         self.box.addItem(self.spacer)
 
     def load( self ):
         self.purgeUnmapped.setChecked(config.setting[r'purgeUnmapped'])
+        self.mergeNormalizedValues.setChecked(config.setting[r'mergeNormalizedValues'])
+        self.rulesInput.setText(config.setting[r'autoMapperRules'])
+        self.auditAutoMapper.setChecked(config.setting[r'auditAutoMapper'])
 
     def save( self ):
         config.setting[r'purgeUnmapped'] = self.purgeUnmapped.isChecked()
+        config.setting[r'mergeNormalizedValues'] = self.mergeNormalizedValues.isChecked()
+        config.setting[r'autoMapperRules'] = self.rulesInput.text()
+        config.setting[r'auditAutoMapper'] = self.auditAutoMapper.isChecked()
+        AutoMapper._refreshRules(force=True)
 
 
 
-register_file_post_addition_to_track_processor(AutoMapper().processFile, priority=PluginPriority.HIGH)
-register_file_post_load_processor(AutoMapper().processFileOnLoad, priority=110) # 110 > HIGH
-register_file_post_save_processor(AutoMapper().processFileAfterSaving, priority=PluginPriority.HIGH)
+register_file_post_addition_to_track_processor(_profiler.wrap(r'file_post_addition_to_track', AutoMapper().processFile), priority=PluginPriority.HIGH)
+register_file_post_load_processor(_profiler.wrap(r'file_post_load', AutoMapper().processFileOnLoad), priority=110) # 110 > HIGH
+register_file_post_save_processor(_profiler.wrap(r'file_post_save', AutoMapper().processFileAfterSaving), priority=PluginPriority.HIGH)
 # register_track_metadata_processor(AutoMapper().process)
 register_options_page(AutoMapperOptionsPage)
@@ -0,0 +1,438 @@
+
+# =============================================================================================
+# This program is free software: you can redistribute it and/or modify it under the terms of
+# the GNU General Public License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# This script must/should come together with a copy of the GNU General Public License. If not,
+# access <http://www.gnu.org/licenses/> to find and read it.
+#
+# Author: Pedro Vernetti G.
+# Name: Batch Normalizer
+# Description: Headless runner for the metapicard tag processors (no Picard GUI needed)
+#
+# #  In order to have this script working, install its dependency: 'mutagen'
+# #  ...then run it from this directory: python3 batchnormalizer.py [OPTIONS] PATH...
+# =============================================================================================
+
+import os, re, sys, json, types, logging, builtins, importlib.util
+from argparse import ArgumentParser
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+
+pluginFiles = { r'automapper':      r'automapper.py',
+                r'originsoblivion': r'originsoblivion.py',
+                r'nobonus':         r'nobonus.py',
+                r'supercomment':    r'supercomment.py',
+                r'omnilyrics':      r'omnilyrics.py', }
+
+# helpers the plugins import as picard.plugins.metapicardcommon (loaded before any of them)
+commonFile = r'metapicardcommon.py'
+
+defaultPlugins = [r'automapper', r'originsoblivion', r'nobonus', r'supercomment']
+
+audioExtensions = { r'.mp3', r'.flac', r'.ogg', r'.oga', r'.opus', r'.ape', r'.wv', r'.mpc', r'.spx', }
+
+# tag formats that cannot be written back (files given explicitly are skipped with this reason)
+unsupportedTags = { r'MP4Tags': r'MP4 tags are not supported', }
+
+# Picard's own settings that the plugins read besides the ones they declare themselves
+picardSettings = { r'preserved_tags': [], r'clear_existing_tags': False, }
+
+
+
+# ---------------------------------------------------------------------------------------------
+# Minimal stand-in for the parts of Picard's API used by the plugins
+# ---------------------------------------------------------------------------------------------
+
+class Metadata( MutableMapping ):
+
+    def __init__( self, *args, **kwargs ):
+        self._store = {}
+        self.length = 0
+        self.update(*args, **kwargs)
+
+    def __getitem__( self, name ):
+        return r'; '.join(self._store.get(name, []))
+
+    def __setitem__( self, name, values ):
+        if (type(values) not in {list, tuple}): values = [values]
+        values = [str(value) for value in values if (value is not None)]
+        if (values): self._store[name] = values
+        else: self._store.pop(name, None)
+
+    def __delitem__( self, name ):
+        del self._store[name]
+
+    def __iter__( self ):
+        return iter(list(self._store))
+
+    def __len__( self ):
+        return len(self._store)
+
+    def __contains__( self, name ):
+        return (name in self._store)
+
+    def get( self, name, default=None ):
+        return self[name] if (name in self._store) else default
+
+    def getall( self, name ):
+        return list(self._store.get(name, []))
+
+    def set( self, name, values ):
+        self[name] = values
+
+    def delete( self, name ):
+        self._store.pop(name, None)
+
+    def pop( self, name, default=None ):
+        values = self._store.pop(name, None)
+        return default if (values is None) else r'; '.join(values)
+
+    def items( self ):
+        for name, values in list(self._store.items()):
+            for value in values: yield (name, value)
+
+    def rawitems( self ):
+        return self._store.items()
+
+    def copy( self, other ):
+        self._store = {name: list(values) for name, values in other.rawitems()}
+        self.length = other.length
+
+    def snapshot( self ):
+        return {name: list(values) for name, values in self._store.items()}
+
+
+
+class File():
+
+    def __init__( self, filename, metadata ):
+        self.filename = filename
+        self.metadata = metadata
+        self.orig_metadata = Metadata()
+        self.orig_metadata.copy(metadata)
+
+    def update( self, signal=True ):
+        pass
+
+
+
+class _Settings( dict ):
+
+    def __missing__( self, name ):
+        raise KeyError(r'unknown setting "' + name + r'"')
+
+
+
+class _Dummy():
+
+    def __init__( self, *args, **kwargs ):
+        pass
+
+    def __getattr__( self, name ):
+        return _Dummy()
+
+    def __call__( self, *args, **kwargs ):
+        return _Dummy()
+
+
+
+class _Registry():
+
+    def __init__( self ):
+        self.hooks = {r'load': [], r'track': [], r'save': []}
+        self.options = {}
+
+    def register( self, hook, processor, priority ):
+        self.hooks[hook] += [(priority, len(self.hooks[hook]), processor)]
+
+    def processors( self, hook ):
+        return [entry[2] for entry in sorted(self.hooks[hook], key=lambda entry: (-entry[0], entry[1]))]
+
+registry = _Registry()
+settings = _Settings(picardSettings)
+
+
+
+def _module( name, **attributes ):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+def _option( section, name, default, *args, **kwargs ):
+    settings.setdefault(name, default)
+    registry.options[name] = default
+
+def _runTask( func, next_func=None, priority=0, thread_pool=None, traceback=True ):
+    try: result, error = func(), None
+    except Exception as e: result, error = None, e
+    if (next_func): next_func(result=result, error=error)
+
+def installStandIns():
+    log = logging.getLogger(r'metapicard')
+    priority = types.SimpleNamespace(HIGH=100, NORMAL=0, LOW=-100)
+    builtins.__dict__.setdefault(r'N_', (lambda message: message)) # Picard installs it for translatable strings
+    _module(r'PyQt5')
+    for qtModule in (r'PyQt5.QtWidgets', r'PyQt5.QtCore', r'PyQt5.QtGui'):
+        _module(qtModule, __getattr__=(lambda name: _Dummy))
+        setattr(sys.modules[r'PyQt5'], qtModule.split(r'.')[1], sys.modules[qtModule])
+    picard = _module(r'picard', log=log)
+    picard.config = _module(r'picard.config', setting=settings, BoolOption=_option, TextOption=_option,
+                            IntOption=_option, FloatOption=_option, ListOption=_option)
+    _module(r'picard.file', File=File,
+            register_file_post_load_processor=(lambda f, priority=0: registry.register(r'load', f, priority)),
+            register_file_post_addition_to_track_processor=(lambda f, priority=0: registry.register(r'track', f, priority)),
+            register_file_post_save_processor=(lambda f, priority=0: registry.register(r'save', f, priority)))
+    _module(r'picard.metadata', Metadata=Metadata,
+            register_track_metadata_processor=(lambda f, priority=0: None),
+            register_album_metadata_processor=(lambda f, priority=0: None))
+    _module(r'picard.plugin', PluginPriority=priority)
+    _module(r'picard.track', Track=type(r'Track', (), {}))
+    _module(r'picard.album', Album=type(r'Album', (), {r'update': (lambda self, update_tracks=True: None)}))
+    _module(r'picard.ui')
+    _module(r'picard.ui.itemviews', BaseAction=type(r'BaseAction', (), {r'tagger': _Dummy()}),
+            register_file_action=(lambda action: None), register_track_action=(lambda action: None),
+            register_album_action=(lambda action: None))
+    _module(r'picard.ui.options', OptionsPage=_Dummy, register_options_page=(lambda page: None))
+    _module(r'picard.plugins')
+    _module(r'picard.util')
+    _module(r'picard.util.thread', run_task=_runTask, to_main=(lambda func, *args, **kwargs: func(*args, **kwargs)))
+    sys.modules[r'picard.util'].thread = sys.modules[r'picard.util.thread']
+    sys.modules[r'picard'].__dict__.update(file=sys.modules[r'picard.file'], metadata=sys.modules[r'picard.metadata'])
+
+def _loadModule( name, path ):
+    spec = importlib.util.spec_from_file_location((r'picard.plugins.' + name), path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def loadPlugins( names, directory=None ):
+    directory = directory or os.path.dirname(os.path.abspath(__file__))
+    if (r'picard.plugins.metapicardcommon' not in sys.modules):
+        _loadModule(r'metapicardcommon', os.path.join(directory, commonFile))
+    return [_loadModule(name, os.path.join(directory, pluginFiles[name])) for name in names]
+
+
+
+# ---------------------------------------------------------------------------------------------
+# Tag reading/writing through mutagen
+# ---------------------------------------------------------------------------------------------
+
+_id3Frames = { r'title': r'TIT2', r'subtitle': r'TIT3', r'grouping': r'TIT1', r'artist': r'TPE1',
+               r'albumartist': r'TPE2', r'conductor': r'TPE3', r'remixer': r'TPE4', r'album': r'TALB',
+               r'composer': r'TCOM', r'lyricist': r'TEXT', r'genre': r'TCON', r'date': r'TDRC',
+               r'originaldate': r'TDOR', r'label': r'TPUB', r'encodedby': r'TENC', r'bpm': r'TBPM',
+               r'media': r'TMED', r'mood': r'TMOO', r'copyright': r'TCOP', r'isrc': r'TSRC',
+               r'key': r'TKEY', r'language': r'TLAN', r'discsubtitle': r'TSST', r'albumsort': r'TSOA',
+               r'artistsort': r'TSOP', r'titlesort': r'TSOT', r'composersort': r'TSOC',
+               r'encodersettings': r'TSSE', r'compilation': r'TCMP', r'albumartistsort': r'TSO2', }
+
+_id3Names = {frameID: name for name, frameID in _id3Frames.items()}
+
+_id3Numbered = { r'TRCK': (r'tracknumber', r'totaltracks'), r'TPOS': (r'discnumber', r'totaldiscs'), }
+
+# same names Picard gives the frames, so what is read is also what gets written back
+def _id3Key( frame ):
+    frameID = frame.FrameID
+    if (frameID == r'TXXX'): return frame.desc
+    if (frameID == r'COMM'): return (r'comment:' + frame.desc) if frame.desc else r'comment'
+    if (frameID == r'USLT'): return (r'lyrics:' + frame.desc) if frame.desc else r'lyrics'
+    return _id3Names.get(frameID, frameID)
+
+def _readID3( tags, metadata ):
+    for frame in tags.values():
+        if (frame.FrameID in _id3Numbered):
+            number, total = (str(frame.text[0]).split(r'/', 1) + [r''])[:2] if frame.text else (r'', r'')
+            metadata[_id3Numbered[frame.FrameID][0]] = number
+            if (total): metadata[_id3Numbered[frame.FrameID][1]] = total
+        elif (frame.FrameID == r'USLT'):
+            metadata[_id3Key(frame)] = metadata.getall(_id3Key(frame)) + [frame.text]
+        elif (frame.FrameID == r'COMM'):
+            metadata[_id3Key(frame)] = metadata.getall(_id3Key(frame)) + [str(text) for text in frame.text]
+        elif (frame.FrameID.startswith(r'T')):
+            metadata[_id3Key(frame)] = metadata.getall(_id3Key(frame)) + [str(text) for text in frame.text]
+
+def _writeID3( tags, deleted, changed ):
+    from mutagen import id3
+    for frame in list(tags.values()):
+        if (frame.FrameID in _id3Numbered): continue
+        key = _id3Key(frame)
+        if ((key in deleted) or (key in changed)):
+            tags.delall(frame.HashKey) if (frame.FrameID in {r'TXXX', r'COMM', r'USLT'}) else tags.delall(frame.FrameID)
+    touched = set(deleted) | set(changed)
+    for frameID, (numberTag, totalTag) in _id3Numbered.items():
+        if ((numberTag not in touched) and (totalTag not in touched)): continue
+        current = tags[frameID].text if (frameID in tags) else []
+        current = (str(current[0]).split(r'/', 1) + [r''])[:2] if current else [r'', r'']
+        number = r'' if (numberTag in deleted) else changed.get(numberTag, [current[0]])[0]
+        total = r'' if (totalTag in deleted) else changed.get(totalTag, [current[1]])[0]
+        tags.delall(frameID)
+        if (number): tags.add(getattr(id3, frameID)(encoding=3, text=(number + ((r'/' + total) if total else r''))))
+    for name, values in changed.items():
+        if (name in {tag for pair in _id3Numbered.values() for tag in pair}): continue
+        if ((name == r'comment') or name.startswith(r'comment:')):
+            tags.add(id3.COMM(encoding=3, lang=r'eng', desc=name[8:], text=values))
+        elif ((name == r'lyrics') or name.startswith(r'lyrics:')):
+            tags.add(id3.USLT(encoding=3, lang=r'eng', desc=name[7:], text=values[0]))
+        elif (name in _id3Frames):
+            tags.add(getattr(id3, _id3Frames[name])(encoding=3, text=values))
+        elif (re.match(r'^T[A-Z0-9]{3}$', name) and hasattr(id3, name)):
+            tags.add(getattr(id3, name)(encoding=3, text=values))
+        else:
+            tags.add(id3.TXXX(encoding=3, desc=re.sub(r'^TXXX:', r'', name), text=values))
+
+class UnsupportedTags( Exception ):
+    pass
+
+def readTags( path ):
+    import mutagen
+    audio = mutagen.File(path)
+    if ((audio is None) or (audio.tags is None)): return None
+    if (type(audio.tags).__name__ in unsupportedTags): raise UnsupportedTags(unsupportedTags[type(audio.tags).__name__])
+    metadata = Metadata()
+    metadata.length = int(getattr(audio.info, r'length', 0) * 1000)
+    tags = audio.tags
+    if (type(tags).__name__ == r'ID3'):
+        _readID3(tags, metadata)
+    else:
+        for key, value in tags.items():
+            if (type(value).__name__.startswith(r'APE')):
+                if (value.kind != 0): continue # binary/external APE items
+                values = list(value)
+            else:
+                values = value if (type(value) == list) else [value]
+            metadata[key.casefold()] = metadata.getall(key.casefold()) + [str(v) for v in values]
+    return metadata
+
+def writeTags( path, deleted, changed ):
+    import mutagen
+    audio = mutagen.File(path)
+    tags = audio.tags
+    if (type(tags).__name__ in unsupportedTags): raise UnsupportedTags(unsupportedTags[type(tags).__name__])
+    if (type(tags).__name__ == r'ID3'):
+        _writeID3(tags, deleted, changed)
+    else:
+        existing = {key.casefold(): key for key in tags.keys()}
+        for name in (set(deleted) | set(changed)):
+            if (name.casefold() in existing): del tags[existing[name.casefold()]]
+        for name, values in changed.items():
+            if (not name.startswith((r'~', r'_'))): tags[name.upper()] = values
+    audio.save()
+
+
+
+# ---------------------------------------------------------------------------------------------
+# Batch processing
+# ---------------------------------------------------------------------------------------------
+
+def _diff( before, after ):
+    after = {name: values for name, values in after.items() if any(values)}
+    deleted = sorted(name for name in before if (name not in after))
+    changed = {name: values for name, values in after.items() if (before.get(name, None) != values)}
+    return (deleted, {name: values for name, values in changed.items() if (not name.startswith(r'~'))})
+
+def _initWorker( plugins, options, verbose ):
+    logging.basicConfig(level=(logging.DEBUG if verbose else logging.WARNING), format=r'%(message)s')
+    installStandIns()
+    loadPlugins(plugins)
+    settings.update(options)
+
+def _processChunk( paths, write ):
+    results = []
+    for path in paths:
+        try:
+            metadata = readTags(path)
+            if (metadata is None):
+                results += [{r'path': path, r'skipped': r'no tags'}]
+                continue
+            file = File(path, metadata)
+            before = metadata.snapshot()
+            for processor in registry.processors(r'load'): processor(file)
+            for processor in registry.processors(r'track'): processor(None, file)
+            deleted, changed = _diff(before, file.metadata.snapshot())
+            if ((not deleted) and (not changed)): continue
+            if (write):
+                writeTags(path, deleted, changed)
+                for processor in registry.processors(r'save'): processor(file)
+            results += [{r'path': path, r'deleted': deleted, r'set': changed}]
+        except UnsupportedTags as e:
+            results += [{r'path': path, r'skipped': str(e)}]
+        except Exception as e:
+            results += [{r'path': path, r'error': (type(e).__name__ + r': ' + str(e))}]
+    return results
+
+def walk( paths ):
+    for path in paths:
+        if (os.path.isfile(path)):
+            yield path
+            continue
+        for root, directories, files in os.walk(path):
+            directories.sort()
+            for name in sorted(files):
+                if (os.path.splitext(name)[1].casefold() in audioExtensions): yield os.path.join(root, name)
+
+def chunked( items, size ):
+    chunk = []
+    for item in items:
+        chunk += [item]
+        if (len(chunk) >= size):
+            yield chunk
+            chunk = []
+    if (chunk): yield chunk
+
+def run( paths, plugins, options, write=False, jobs=None, chunkSize=64, output=sys.stdout, verbose=False ):
+    jobs = jobs or os.cpu_count() or 1
+    counts = {r'changed': 0, r'errors': 0, r'skipped': 0}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_initWorker, initargs=(plugins, options, verbose)) as pool:
+        pending = set()
+        for chunk in chunked(walk(paths), chunkSize):
+            pending.add(pool.submit(_processChunk, chunk, write))
+            if (len(pending) < (jobs * 2)): continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done: _report(future.result(), counts, output)
+        for future in pending: _report(future.result(), counts, output)
+    return counts
+
+def _report( results, counts, output ):
+    for result in results:
+        if (r'error' in result): counts[r'errors'] += 1
+        elif (r'skipped' in result): counts[r'skipped'] += 1
+        else: counts[r'changed'] += 1
+        output.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+def _parsedOption( assignment ):
+    name, _, value = assignment.partition(r'=')
+    if (value.casefold() in {r'true', r'yes', r'on', r'1'}): value = True
+    elif (value.casefold() in {r'false', r'no', r'off', r'0'}): value = False
+    return (name.strip(), value)
+
+
+
+if (__name__ == "__main__"):
+
+    parser = ArgumentParser(description=r'Run metapicard tag processors over audio files without Picard.')
+    parser.add_argument(r'paths', nargs=r'+', metavar=r'PATH', help=r'files or directories to process')
+    parser.add_argument(r'-p', r'--plugins', default=r','.join(defaultPlugins),
+                        help=(r'comma-separated processors to run (available: ' + r', '.join(pluginFiles) + r')'))
+    parser.add_argument(r'-o', r'--option', action=r'append', default=[], metavar=r'NAME=VALUE',
+                        help=r'override a plugin/Picard setting (repeatable)')
+    parser.add_argument(r'-w', r'--write', action=r'store_true', help=r'write changes back (default: only print a diff)')
+    parser.add_argument(r'-j', r'--jobs', type=int, default=None, help=r'worker processes (default: all cores)')
+    parser.add_argument(r'-c', r'--chunk-size', type=int, default=64, help=r'files per worker task')
+    parser.add_argument(r'-v', r'--verbose', action=r'store_true', help=r'log plugin debug messages')
+    arguments = parser.parse_args()
+    plugins = [name.strip() for name in arguments.plugins.split(r',') if name.strip()]
+    unknown = [name for name in plugins if (name not in pluginFiles)]
+    if (unknown): parser.error(r'unknown processor(s): ' + r', '.join(unknown))
+    options = dict(_parsedOption(assignment) for assignment in arguments.option)
+    counts = run(arguments.paths, plugins, options, arguments.write, arguments.jobs, arguments.chunk_size,
+                 verbose=arguments.verbose)
+    sys.stderr.write(r'{changed} file(s) changed, {skipped} skipped, {errors} error(s)'.format(**counts) + '\n')
+    sys.exit(1 if counts[r'errors'] else 0)
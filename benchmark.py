@@ -0,0 +1,116 @@
+
+# =============================================================================================
+# This program is free software: you can redistribute it and/or modify it under the terms of
+# the GNU General Public License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# This script must/should come together with a copy of the GNU General Public License. If not,
+# access <http://www.gnu.org/licenses/> to find and read it.
+#
+# Author: Pedro Vernetti G.
+# Name: Benchmark
+# Description: Micro-benchmarks of the metapicard processors over a synthetic messy corpus
+#
+# #  Run it from this directory: python3 benchmark.py [--save-baseline] [--count N]
+# =============================================================================================
+
+import os, sys, json, time, tracemalloc
+from argparse import ArgumentParser
+
+import batchnormalizer, messycorpus
+
+
+
+# (plugin, class) pairs whose 'process' is measured
+processors = [ (r'automapper', r'AutoMapper'), (r'originsoblivion', r'OriginsOblivion'),
+               (r'nobonus', r'NoBonus'), (r'supercomment', r'SuperComment'), ]
+
+
+
+def _baselinePath():
+    cacheDirectory = os.environ.get(r'XDG_CACHE_HOME', os.path.join(os.path.expanduser(r'~'), r'.cache'))
+    return os.path.join(cacheDirectory, r'metapicard', r'benchmark-baseline.json')
+
+def _corpus( tagSets, length ):
+    corpus = []
+    for tags in tagSets:
+        metadata = batchnormalizer.Metadata(tags)
+        metadata.length = length
+        corpus += [metadata]
+    return corpus
+
+def _fresh( corpus ):
+    copies = []
+    for metadata in corpus:
+        copy = batchnormalizer.Metadata()
+        copy.copy(metadata)
+        copies += [copy]
+    return copies
+
+def _measure( process, corpus, repeat ):
+    best = None
+    for i in range(repeat):
+        copies = _fresh(corpus)
+        start = time.perf_counter()
+        for metadata in copies: process(None, metadata, None, None)
+        elapsed = time.perf_counter() - start
+        best = elapsed if ((best is None) or (elapsed < best)) else best
+    copies = _fresh(corpus)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for metadata in copies: process(None, metadata, None, None)
+    after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    allocations = sum(stat.count_diff for stat in after.compare_to(before, r'filename') if (stat.count_diff > 0))
+    return { r'filesPerSecond': round(len(corpus) / best, 1), r'peakBytesPerFile': (peak // len(corpus)),
+             r'retainedBlocksPerFile': round(allocations / len(corpus), 2), }
+
+def run( count, seed, repeat, selected=None, options=None ):
+    batchnormalizer.installStandIns()
+    modules = batchnormalizer.loadPlugins([plugin for plugin, className in processors])
+    batchnormalizer.settings.update(options or {})
+    corpus = _corpus(messycorpus.generate(count, seed), 240000)
+    results = {}
+    for (plugin, className), module in zip(processors, modules):
+        if (selected and (plugin not in selected)): continue
+        results[className] = _measure(getattr(module, className)().process, corpus, repeat)
+    return results
+
+def _report( results, baseline, output ):
+    output.write(r'{:<18}{:>14}{:>10}{:>18}{:>18}'.format(r'processor', r'files/s', r'vs base', r'peak B/file', r'retained/file') + '\n')
+    for name, result in results.items():
+        reference = baseline.get(name, {}).get(r'filesPerSecond', None)
+        ratio = (r'{:.2f}x'.format(result[r'filesPerSecond'] / reference)) if reference else r'-'
+        output.write(r'{:<18}{:>14}{:>10}{:>18}{:>18}'.format(name, result[r'filesPerSecond'], ratio,
+                     result[r'peakBytesPerFile'], result[r'retainedBlocksPerFile']) + '\n')
+
+
+
+if (__name__ == "__main__"):
+
+    parser = ArgumentParser(description=r'Benchmark the metapicard processors over a synthetic messy corpus.')
+    parser.add_argument(r'-n', r'--count', type=int, default=2000, help=r'number of synthetic files')
+    parser.add_argument(r'-s', r'--seed', type=int, default=0, help=r'corpus random seed')
+    parser.add_argument(r'-r', r'--repeat', type=int, default=3, help=r'timing repetitions (best one is kept)')
+    parser.add_argument(r'-p', r'--processors', default=r'', help=r'comma-separated plugins to measure (default: all)')
+    parser.add_argument(r'-b', r'--baseline', default=_baselinePath(), help=r'baseline JSON to compare against')
+    parser.add_argument(r'--save-baseline', action=r'store_true', help=r'store these results as the new baseline')
+    parser.add_argument(r'--json', action=r'store_true', help=r'print results as JSON instead of a table')
+    arguments = parser.parse_args()
+    selected = {name.strip() for name in arguments.processors.split(r',') if name.strip()}
+    results = run(arguments.count, arguments.seed, arguments.repeat, selected)
+    baseline = {}
+    if (os.path.isfile(arguments.baseline)):
+        with open(arguments.baseline, r'r', encoding=r'utf-8') as baselineFile: baseline = json.load(baselineFile)
+        if ((baseline.get(r'count', None), baseline.get(r'seed', None)) != (arguments.count, arguments.seed)):
+            sys.stderr.write(r'warning: baseline was measured over a different corpus' + '\n')
+        baseline = baseline.get(r'results', {})
+    if (arguments.json): sys.stdout.write(json.dumps(results, indent=2) + '\n')
+    else: _report(results, baseline, sys.stdout)
+    if (arguments.save_baseline):
+        os.makedirs(os.path.dirname(arguments.baseline), exist_ok=True)
+        with open(arguments.baseline, r'w', encoding=r'utf-8') as baselineFile:
+            json.dump({r'count': arguments.count, r'seed': arguments.seed, r'results': results}, baselineFile, indent=2)
@@ -0,0 +1,135 @@
+
+# =============================================================================================
+# This program is free software: you can redistribute it and/or modify it under the terms of
+# the GNU General Public License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# This script must/should come together with a copy of the GNU General Public License. If not,
+# access <http://www.gnu.org/licenses/> to find and read it.
+#
+# Author: Pedro Vernetti G.
+# Name: metapicard Diagnostics
+# Description: MusicBrainz Picard plugin to profile the other metapicard plugins
+#
+# #  In order to have this plugin working (if it is currently not), place it at:
+#    ~/.config/MusicBrainz/Picard/plugins
+# =============================================================================================
+
+import sys, json
+from time import strftime
+
+
+
+PLUGIN_NAME = 'metapicard Diagnostics'
+PLUGIN_AUTHOR = 'Pedro Vernetti G.'
+PLUGIN_DESCRIPTION = 'Call counts, latency histograms and cProfile dumps of the slowest calls of the other metapicard plugins.'
+PLUGIN_VERSION = '0.1'
+PLUGIN_API_VERSIONS = ['2.0', '2.1', '2.2', '2.3', '2.4', '2.5', '2.6']
+PLUGIN_LICENSE = 'GPLv3'
+PLUGIN_LICENSE_URL = 'https://www.gnu.org/licenses/gpl-3.0.en.html'
+
+from PyQt5 import QtWidgets
+from picard.config import BoolOption
+from picard import config, log
+from picard.ui.options import OptionsPage, register_options_page
+
+
+
+# every metapicard plugin keeps its own '_profiler', found here among the loaded plugin modules
+def _profilers():
+    return [module._profiler for name, module in sorted(sys.modules.items(), key=(lambda item: item[0]))
+            if (name.startswith(r'picard.plugins.') and hasattr(getattr(module, r'_profiler', None), r'snapshot'))]
+
+def _snapshots():
+    return [profiler.snapshot() for profiler in _profilers()]
+
+def _milliseconds( seconds ):
+    return (r'{:.3g} ms'.format(seconds * 1000) if (seconds < 1) else r'{:.3g} s'.format(seconds))
+
+def _report( snapshots ):
+    lines = []
+    for snapshot in snapshots:
+        lines += [snapshot[r'plugin'] + (r'' if snapshot[r'enabled'] else r' (not profiling)')]
+        labels = [(r'≤' + _milliseconds(bound)) for bound in snapshot[r'buckets']]
+        labels += [r'>' + _milliseconds(snapshot[r'buckets'][-1])]
+        for hook, stats in sorted(snapshot[r'hooks'].items()):
+            mean = (stats[r'seconds'] / stats[r'calls']) if (stats[r'calls']) else 0.0
+            lines += [r'  {}: {} calls, {} errors, mean {}, max {}'.format(hook, stats[r'calls'], stats[r'errors'],
+                                                                         _milliseconds(mean), _milliseconds(stats[r'max']))]
+            lines += [r'    ' + r'  '.join((label + r': ' + str(count)) for label, count in zip(labels, stats[r'histogram']) if (count))]
+            for entry in snapshot[r'slowest'].get(hook, []):
+                lines += [r'    ' + _milliseconds(entry[r'seconds']) + r' profiled at ' + entry[r'dump']]
+        lines += [r'']
+    return ('\n'.join(lines).strip() or r'No metapicard plugin is loaded.')
+
+
+
+class DiagnosticsOptionsPage( OptionsPage ):
+
+    NAME = r'metapicarddiagnostics'
+    TITLE = PLUGIN_NAME
+    PARENT = r'advanced'
+
+    options = [ BoolOption(r'setting', r'profileMetapicard', False),
+                BoolOption(r'setting', r'profileMetapicardDumps', False) ]
+
+    def __init__( self, parent=None ):
+        super().__init__(parent)
+        self.box = QtWidgets.QVBoxLayout(self)
+        self.profileMetapicard = QtWidgets.QCheckBox(self)
+        self.profileMetapicard.setCheckable(True)
+        self.profileMetapicard.setChecked(False)
+        self.profileMetapicard.setText(r'Count and time every call of the metapicard plugins (slightly slower)')
+        self.box.addWidget(self.profileMetapicard)
+        self.profileMetapicardDumps = QtWidgets.QCheckBox(self)
+        self.profileMetapicardDumps.setCheckable(True)
+        self.profileMetapicardDumps.setChecked(False)
+        self.profileMetapicardDumps.setText(r'Sample calls with cProfile and keep dumps of the slowest ones (in the cache directory)')
+        self.box.addWidget(self.profileMetapicardDumps)
+        self.report = QtWidgets.QPlainTextEdit(self)
+        self.report.setReadOnly(True)
+        self.box.addWidget(self.report)
+        self.buttons = QtWidgets.QHBoxLayout()
+        self.refreshButton = QtWidgets.QPushButton(r'Refresh', self)
+        self.refreshButton.clicked.connect(self.refresh)
+        self.buttons.addWidget(self.refreshButton)
+        self.resetButton = QtWidgets.QPushButton(r'Reset', self)
+        self.resetButton.clicked.connect(self.reset)
+        self.buttons.addWidget(self.resetButton)
+        self.exportButton = QtWidgets.QPushButton(r'Export JSON…', self)
+        self.exportButton.clicked.connect(self.export)
+        self.buttons.addWidget(self.exportButton)
+        self.box.addLayout(self.buttons)
+
+    def refresh( self ):
+        self.report.setPlainText(_report(_snapshots()))
+
+    def reset( self ):
+        for profiler in _profilers(): profiler.reset()
+        self.refresh()
+
+    def export( self ):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, r'Export profiling data', r'metapicard-profile.json', r'JSON (*.json)')
+        if (not path): return
+        try:
+            with open(path, r'w', encoding=r'utf-8') as exported:
+                json.dump({r'exported': strftime(r'%Y-%m-%dT%H:%M:%S'), r'plugins': _snapshots()}, exported, indent=2)
+        except OSError as e:
+            log.error(r'{}: cannot export profiling data to "{}": {}'.format(PLUGIN_NAME, path, e))
+
+    def load( self ):
+        self.profileMetapicard.setChecked(config.setting[r'profileMetapicard'])
+        self.profileMetapicardDumps.setChecked(config.setting[r'profileMetapicardDumps'])
+        self.refresh()
+
+    def save( self ):
+        config.setting[r'profileMetapicard'] = self.profileMetapicard.isChecked()
+        config.setting[r'profileMetapicardDumps'] = self.profileMetapicardDumps.isChecked()
+        for profiler in _profilers():
+            profiler.configure(config.setting[r'profileMetapicard'], config.setting[r'profileMetapicardDumps'])
+
+
+
+register_options_page(DiagnosticsOptionsPage)
@@ -0,0 +1,137 @@
+
+# =============================================================================================
+# This program is free software: you can redistribute it and/or modify it under the terms of
+# the GNU General Public License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# This script must/should come together with a copy of the GNU General Public License. If not,
+# access <http://www.gnu.org/licenses/> to find and read it.
+#
+# Author: Pedro Vernetti G.
+# Name: Messy Corpus
+# Description: Generator of synthetic, realistically messy tag sets for benchmarking
+#
+# #  Run it from this directory: python3 messycorpus.py --count 1000 > corpus.jsonl
+# =============================================================================================
+
+import sys, json, random
+from argparse import ArgumentParser
+
+import batchnormalizer
+
+
+
+_words = [ r'love', r'night', r'river', r'fire', r'ghost', r'heart', r'road', r'city', r'dream',
+           r'summer', r'shadow', r'light', r'stone', r'rain', r'blue', r'gold', r'electric', r'wild',
+           r'broken', r'silent', r'canção', r'noite', r'coração', r'über', r'straße', r'été', ]
+
+_titleSuffixes = [ r'', r'', r'', r'', r' (Bonus Track)', r' [bonus]', r' (Previously Unreleased)',
+                   r' (Deluxe Edition)', r' [Deluxe]', r' (Collector\'s Edition)', r' (Studio Outtake)',
+                   r' (Standard Version)', r' (Exclusive Track)', r' (Live)', r' (Remix)', r' ()', ]
+
+_albumSuffixes = [ r'', r'', r'', r' (Deluxe Edition)', r' [Special Edition]', r' (Extended Edition)',
+                   r' (Bonus Disc)', r' - EP', r' (Single)', r' Demo', r' (bootleg)', r' LP', ]
+
+_media = [ r'CD', r'CD', r'Digital Media', r'12" Vinyl', r'7" Vinyl', r'Vinyl', r'Cassette',
+           r'Enhanced CD', r'HDCD', r'SHM-CD', r'DVD-Audio', r'Blu-ray', r'SACD', r'8cm CD',
+           r'FLAC', r'mp3 download', r'Spotify', r'Bandcamp', r'Compact Disc', r'Flexi-disc',
+           r'Reel-To-Reel', r'USB Flash Drive', r'Other', r'', ]
+
+_labels = [ r'Sony Music', r'EMI', r'Universal Music Group', r'Warner Bros. Records', r'Sub Pop',
+            r'Self-Released', r'[no label]', r'Independent', r'Matador Records; Beggars Group',
+            r'4AD/XL Recordings', r'Som Livre', r'Deck Disc', r'Polysom', r'unknown', ]
+
+_catalogNumbers = [ r'', r'', r'none', r'N/A', r'SP 123', r'88697123452', r'OLE-1234-2', r'CAT 001; CAT 001X', ]
+
+_releaseTypes = [ r'album', r'single', r'ep', r'album; compilation', r'album/live', r'other', r'', r'broadcast', ]
+
+_releaseStatuses = [ r'official', r'official', r'promotion', r'bootleg', r'', ]
+
+_countries = [ r'US', r'GB', r'BR', r'DE', r'JP', r'XE', r'XW', r'FR', r'PT', r'', ]
+
+_comments = [ r'Ripped by EAC', r'Visit www.example.com', r'Encoded with LAME 3.99', r'00000A2B 00000C3D',
+              r'Downloaded from http://music.example.net', r'Great album!', r'', r'ExactAudioCopy v1.0', ]
+
+_software = [ r'LAME 3.100', r'Exact Audio Copy', r'iTunes 12.9.5.5', r'foobar2000 v1.6', r'dBpoweramp', ]
+
+# Spellings per tagging format, with the generic name going into '{}'
+_keyStyles = [ (lambda key: key.upper()), (lambda key: key.casefold()), (lambda key: r'TXXX:' + key),
+               (lambda key: r'----:com.apple.iTunes:' + key), (lambda key: r'WM/' + key.title()),
+               (lambda key: r'iTunes_' + key), (lambda key: key.title().replace(r'_', r' ')), ]
+
+_standardAliases = { r'title':       [r'TIT2', r'©nam', r'INAM', r'TITLE', r'Title'],
+                     r'artist':      [r'TPE1', r'©ART', r'IART', r'ARTIST', r'Author'],
+                     r'album':       [r'TALB', r'©alb', r'IPRD', r'ALBUM', r'WM/AlbumTitle'],
+                     r'albumartist': [r'TPE2', r'aART', r'ALBUMARTIST', r'Album Artist', r'WM/AlbumArtist'],
+                     r'date':        [r'TDRC', r'©day', r'ICRD', r'DATE', r'YEAR', r'WM/Year'],
+                     r'tracknumber': [r'TRCK', r'trkn', r'ITRK', r'TRACKNUMBER', r'Track'],
+                     r'discnumber':  [r'TPOS', r'disk', r'DISCNUMBER', r'PartOfSet'], }
+
+
+
+def _phrase( rng, count ):
+    return r' '.join(rng.choice(_words) for i in range(count)).title()
+
+def _aliasKeys():
+    batchnormalizer.installStandIns()
+    automapper, originsoblivion = batchnormalizer.loadPlugins([r'automapper', r'originsoblivion'])
+    return (sorted(automapper.AutoMapper._mapping), sorted(automapper.AutoMapper._splitfulMapping),
+            sorted(originsoblivion.OriginsOblivion._defaultTargets))
+
+def generate( count, seed=0 ):
+    rng = random.Random(seed)
+    mapped, splitful, purgeable = _aliasKeys()
+    albums = []
+    for i in range(count):
+        if ((not albums) or (rng.random() < 0.1)):
+            album = { r'album': (_phrase(rng, rng.randint(1, 4)) + rng.choice(_albumSuffixes)),
+                      r'albumartist': _phrase(rng, rng.randint(1, 3)), r'media': rng.choice(_media),
+                      r'label': rng.choice(_labels), r'catalognumber': rng.choice(_catalogNumbers),
+                      r'releasetype': rng.choice(_releaseTypes), r'releasestatus': rng.choice(_releaseStatuses),
+                      r'releasecountry': rng.choice(_countries), r'date': str(rng.randint(1960, 2024)),
+                      r'totaltracks': str(rng.randint(1, 20)), r'totaldiscs': rng.choice([r'1', r'1', r'2']),
+                      r'barcode': str(rng.randint(10**11, 10**13)), }
+            albums = (albums + [(album, rng.getrandbits(32))])[-8:]
+        album, layoutSeed = rng.choice(albums)
+        # tracks of an album usually share the tag layout of the tool that tagged them
+        layout = random.Random(layoutSeed if (rng.random() < 0.8) else rng.getrandbits(32))
+        tags = {}
+        for name, value in album.items():
+            if (layout.random() < 0.15): continue
+            key = layout.choice(_standardAliases[name]) if ((name in _standardAliases) and (layout.random() < 0.5)) else name
+            tags[key] = [value]
+        titleKey = layout.choice(_standardAliases[r'title']) if (layout.random() < 0.5) else r'title'
+        tags[titleKey] = [_phrase(rng, rng.randint(1, 5)) + rng.choice(_titleSuffixes)]
+        tags[r'titlesort'] = [tags[titleKey][0] + rng.choice([r'', r'', r', The'])]
+        artists = [_phrase(rng, rng.randint(1, 3)) for j in range(rng.choice([1, 1, 1, 2, 3]))]
+        tags[layout.choice(_standardAliases[r'artist'] + [r'artist'])] = artists
+        tags[r'genre'] = [_phrase(rng, 1) for j in range(rng.randint(0, 3))] or [r'Rock']
+        tags[layout.choice(_standardAliases[r'tracknumber'])] = [rng.choice([r'{}', r'{}/{}', r'0{}', r'{} of {}']).format(rng.randint(1, 20), album[r'totaltracks'])]
+        for j in range(layout.randint(2, 10)):
+            tags[layout.choice(_keyStyles)(layout.choice(mapped))] = [_phrase(rng, rng.randint(1, 3)) for k in range(rng.choice([1, 1, 2]))]
+        for j in range(layout.randint(0, 2)):
+            tags[layout.choice(_keyStyles)(layout.choice(splitful))] = [r'{}/{}'.format(rng.randint(1, 9), rng.randint(9, 20))]
+        for j in range(layout.randint(0, 5)):
+            tags[layout.choice(_keyStyles)(layout.choice(purgeable))] = [rng.choice(_software)]
+        if (layout.random() < 0.5):
+            tags[layout.choice([r'comment', r'COMM', r'comment:ID3v1 Comment', r'©cmt', r'ICMT'])] = [rng.choice(_comments)]
+        if (layout.random() < 0.3):
+            tags[layout.choice([r'discogs_release_id', r'DISCOGS_ARTIST_NAME', r'iTunNORM', r'LASTFM_TAGS', r'MusicIP_PUID', r'acoustid_id'])] = [_phrase(rng, 1)]
+        if (layout.random() < 0.3):
+            tags[layout.choice([r'musicbrainz_trackid', r'MusicBrainz Album Id', r'musicbrainz_artistid'])] = [r'%08x-0000-4000-8000-%012x' % (rng.getrandbits(32), rng.getrandbits(48))]
+        if (rng.random() < 0.2):
+            tags[rng.choice([r'lyrics', r'USLT', r'lyrics:description', r'UNSYNCEDLYRICS'])] = ['\n'.join(_phrase(rng, 6) for k in range(rng.randint(4, 30)))]
+        yield tags
+
+
+
+if (__name__ == "__main__"):
+
+    parser = ArgumentParser(description=r'Generate synthetic messy tag sets (one JSON object per line).')
+    parser.add_argument(r'-n', r'--count', type=int, default=1000, help=r'number of tag sets to generate')
+    parser.add_argument(r'-s', r'--seed', type=int, default=0, help=r'random seed (same seed, same corpus)')
+    arguments = parser.parse_args()
+    for tags in generate(arguments.count, arguments.seed):
+        sys.stdout.write(json.dumps(tags, ensure_ascii=False) + '\n')
@@ -0,0 +1,404 @@
+
+# =============================================================================================
+# This program is free software: you can redistribute it and/or modify it under the terms of
+# the GNU General Public License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+# This script must/should come together with a copy of the GNU General Public License. If not,
+# access <http://www.gnu.org/licenses/> to find and read it.
+#
+# Author: Pedro Vernetti G.
+# Name: metapicard Common
+# Description: Helpers shared by the metapicard plugins (registers nothing by itself)
+#
+# #  In order to have this plugin working (if it is currently not), place it at:
+#    ~/.config/MusicBrainz/Picard/plugins
+#    (next to the other metapicard plugins, which import it as picard.plugins.metapicardcommon)
+# =============================================================================================
+
+import os, re, json, atexit, sqlite3, hashlib, cProfile
+from time import time, strftime, perf_counter
+from bisect import bisect_left
+from threading import Lock, Timer
+from functools import partial, wraps
+from collections import deque
+
+
+
+PLUGIN_NAME = 'metapicard Common'
+PLUGIN_AUTHOR = 'Pedro Vernetti G.'
+PLUGIN_DESCRIPTION = 'Helpers shared by the other metapicard plugins: tag name forms, profiling, audit trails, album batches and the fingerprint index.'
+PLUGIN_VERSION = '0.1'
+PLUGIN_API_VERSIONS = ['2.0', '2.1', '2.2', '2.3', '2.4', '2.5', '2.6']
+PLUGIN_LICENSE = 'GPLv3'
+PLUGIN_LICENSE_URL = 'https://www.gnu.org/licenses/gpl-3.0.en.html'
+
+from picard import config, log
+from picard.metadata import Metadata
+from picard.util import thread
+
+
+
+def cacheDirectory():
+    cacheHome = os.environ.get(r'XDG_CACHE_HOME', r'') or os.path.join(os.path.expanduser(r'~'), r'.cache')
+    return os.path.join(cacheHome, r'metapicard')
+
+
+
+# Normalized forms of each tag name, computed once per file and shared by all metapicard plugins
+# through an attribute of the file: (base, stripped, flat, purgeFlat, compact)
+keyFormsAttribute = r'metapicardKeyForms'
+_keySeparators = re.compile(r'[\s:/_-]+')
+_keyJunk = re.compile(r'[^\w_]')
+_keyPrefix = re.compile(r'^\W*(wm|txxx|((com\W*)?apple\W*)?itunes|lastfm)\W*')
+_keyPurgePrefix = re.compile(r'^\W*(wm|((com\W*)?apple\W*)?itunes|lastfm)\W*')
+_keyFlattener = re.compile(r'[_~]')
+_keyNonWord = re.compile(r'\W')
+_vendorSpelling = re.compile(r'^(com)?(apple)?(?=itunes)')
+
+def keyForms( key ):
+    base = _keyJunk.sub(r'', _keySeparators.sub(r'_', key.casefold()))
+    stripped = _keyPrefix.sub(r'', base)
+    purgeFlat = _keyFlattener.sub(r'', _keyPurgePrefix.sub(r'', base))
+    return (base, stripped, _keyFlattener.sub(r'', stripped), purgeFlat, _keyNonWord.sub(r'', key).casefold())
+
+# flat form that keeps the vendor prefix (iTunes spelled one way), which user rules are keyed by
+def vendorKey( forms ):
+    return _vendorSpelling.sub(r'', _keyFlattener.sub(r'', forms[0]))
+
+def fileKeyForms( metadata, f=None ):
+    cached = getattr(f, keyFormsAttribute, None) or {}
+    forms = {key: (cached.get(key, None) or keyForms(key)) for key in metadata}
+    if (f is not None): setattr(f, keyFormsAttribute, forms)
+    return forms
+
+
+
+# Opt-in call counts, latency histograms and cProfile dumps of the slowest calls of every registered
+# hook; each plugin keeps its own instance as '_profiler', which the metapicard diagnostics plugin
+# (that declares the options) collects through sys.modules
+class Profiler():
+
+    buckets = ( 0.0001, 0.001, 0.01, 0.1, 1.0, 10.0, ) # upper bounds (seconds), plus one for slower calls
+    sampleEvery = 10
+    slowestKept = 3
+
+    def __init__( self, plugin ):
+        self.plugin = plugin
+        self.lock = Lock()
+        self.profiling = Lock()
+        self.enabled = None
+        self.dumps = False
+        self.reset()
+
+    def reset( self ):
+        with self.lock:
+            self.hooks = {}
+            self.slowest = {}
+
+    def configure( self, enabled, dumps ):
+        self.enabled, self.dumps = bool(enabled), bool(dumps)
+
+    def _resolve( self ):
+        try: self.configure(config.setting[r'profileMetapicard'], config.setting[r'profileMetapicardDumps'])
+        except KeyError: self.configure(False, False)
+
+    def wrap( self, hook, function ):
+        @wraps(function)
+        def profiled( *args, **kwargs ):
+            if (self.enabled is None): self._resolve()
+            if (not self.enabled): return function(*args, **kwargs)
+            return self._call(hook, function, args, kwargs)
+        return profiled
+
+    def action( self, hook, action ):
+        action.callback = self.wrap(hook, action.callback)
+        return action
+
+    def _startProfile( self ):
+        if (not self.profiling.acquire(blocking=False)): return None
+        profile = cProfile.Profile()
+        try: profile.enable()
+        except ValueError: # another profiler is active
+            self.profiling.release()
+            return None
+        return profile
+
+    def _call( self, hook, function, args, kwargs ):
+        with self.lock:
+            stats = self.hooks.get(hook, None)
+            if (stats is None):
+                stats = { r'calls': 0, r'errors': 0, r'seconds': 0.0, r'max': 0.0,
+                          r'histogram': ([0] * (len(self.buckets) + 1)), }
+                self.hooks[hook] = stats
+            stats[r'calls'] += 1
+            sampled = (self.dumps and ((stats[r'calls'] % self.sampleEvery) == 1))
+        profile = self._startProfile() if (sampled) else None
+        startedAt, failed = perf_counter(), True
+        try:
+            result = function(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            seconds = perf_counter() - startedAt
+            if (profile):
+                profile.disable()
+                self.profiling.release()
+            self._record(hook, seconds, failed, profile)
+
+    def _record( self, hook, seconds, failed, profile ):
+        with self.lock:
+            stats = self.hooks[hook]
+            stats[r'errors'] += int(failed)
+            stats[r'seconds'] += seconds
+            stats[r'max'] = max(stats[r'max'], seconds)
+            stats[r'histogram'][bisect_left(self.buckets, seconds)] += 1
+            if (not profile): return
+            slowest = self.slowest.setdefault(hook, [])
+            if (len(slowest) < self.slowestKept):
+                slot = len(slowest)
+                slowest += [None]
+            else:
+                slot = min(range(len(slowest)), key=(lambda i: slowest[i][0]))
+                if (seconds <= slowest[slot][0]): return
+            name = r'profile-{}-{}-{}.prof'.format(re.sub(r'\W', r'', self.plugin).casefold(), hook, slot)
+            path = os.path.join(cacheDirectory(), name)
+            slowest[slot] = (seconds, path)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            profile.dump_stats(path)
+        except OSError as e:
+            log.warning(r'{}: cannot write profile to "{}": {}'.format(self.plugin, path, e))
+
+    def snapshot( self ):
+        with self.lock:
+            hooks = {hook: dict(stats, histogram=list(stats[r'histogram'])) for hook, stats in self.hooks.items()}
+            slowest = {hook: [{r'seconds': seconds, r'dump': path} for seconds, path in sorted(entries, reverse=True)]
+                       for hook, entries in self.slowest.items()}
+        return { r'plugin': self.plugin, r'enabled': bool(self.enabled), r'buckets': list(self.buckets),
+                 r'hooks': hooks, r'slowest': slowest, }
+
+
+
+# Opt-in summary of what a plugin's rules did (files seen, time spent, bytes removed, hits per rule,
+# rules that never fired and a few before/after samples), kept in memory and written to the cache
+# directory every 'writeInterval' seconds and at exit; 'rules' returns the names of the rules in effect
+class AuditTrail():
+
+    writeInterval = 30
+    sampleEvery = 100
+    sampleSize = 20
+
+    def __init__( self, name, rules ):
+        self.name = name
+        self.rules = rules
+        self.path = os.path.join(cacheDirectory(), (r'audit-' + re.sub(r'\W', r'', name).casefold() + r'.json'))
+        self.lock = Lock()
+        self.started = strftime(r'%Y-%m-%dT%H:%M:%S')
+        self.files, self.seconds, self.bytesRemoved = 0, 0.0, 0
+        self.hits = {}
+        self.samples = deque(maxlen=self.sampleSize)
+        self.writtenAt = time()
+        atexit.register(self.write)
+
+    @staticmethod
+    def size( metadata ):
+        return sum(len(value.encode(r'utf-8')) for tagName in metadata for value in metadata.getall(tagName))
+
+    def record( self, seconds, hits, sizeBefore, keysBefore, metadata ):
+        sizeAfter = self.size(metadata)
+        with self.lock:
+            self.files += 1
+            self.seconds += seconds
+            self.bytesRemoved += max(0, (sizeBefore - sizeAfter))
+            for rule, count in hits.items(): self.hits[rule] = self.hits.get(rule, 0) + count
+            if ((self.files % self.sampleEvery) == 1):
+                self.samples.append({r'before': sorted(keysBefore), r'after': sorted(metadata)})
+            due = ((time() - self.writtenAt) >= self.writeInterval)
+        if (due): self.write()
+
+    def write( self ):
+        with self.lock:
+            if (not self.files): return
+            self.writtenAt = time()
+            summary = { r'plugin': self.name, r'since': self.started, r'files': self.files,
+                        r'seconds': round(self.seconds, 3), r'bytesRemoved': self.bytesRemoved,
+                        r'hits': dict(sorted(self.hits.items(), key=lambda hit: (-hit[1], hit[0]))),
+                        r'neverFired': sorted(set(self.rules()) - set(self.hits)),
+                        r'samples': list(self.samples), }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open((self.path + r'.tmp'), r'w', encoding=r'utf-8') as auditFile:
+                json.dump(summary, auditFile, ensure_ascii=False, indent=1)
+            os.replace((self.path + r'.tmp'), self.path)
+        except OSError as e:
+            log.warning(r'{}: cannot write audit trail to "{}": {}'.format(self.name, self.path, e))
+
+
+
+# Processes the files of the selected albums in chunks on Picard's worker threads: each worker
+# gets snapshots of the files' metadata and returns change-sets (deletions, sets), which are only
+# applied to the files on the main thread; 'action' provides _prepareAlbum (main thread, before
+# any worker starts), _processAlbumFile, _finish (applies a change-set) and _albumsFinished
+class AlbumBatch():
+
+    chunkSize = 8
+
+    def __init__( self, action, albums, profiler, chunkSize=None ):
+        self.action = action
+        self.albums = albums
+        self.profiler = profiler
+        self.plugin = profiler.plugin
+        self.files = [(album, track, f) for album in albums for track in album.tracks for f in track.linked_files]
+        self.chunkSize = chunkSize or self.chunkSize
+        self.pending = 0
+        self.done = 0
+        self.failed = 0
+
+    @staticmethod
+    def snapshot( f ):
+        metadata = Metadata()
+        metadata.copy(f.metadata)
+        return metadata
+
+    @staticmethod
+    def changes( before, after ):
+        before = {tagName: list(values) for tagName, values in before}
+        after = {tagName: list(values) for tagName, values in after}
+        deletions = tuple(tagName for tagName in before if (tagName not in after))
+        sets = {tagName: values for tagName, values in after.items() if (before.get(tagName, None) != values)}
+        return (deletions, sets)
+
+    @staticmethod
+    def apply( f, changes ):
+        deletions, sets = changes
+        for tagName in deletions: f.metadata.pop(tagName, None)
+        for tagName, values in sets.items(): f.metadata[tagName] = values
+        f.update(signal=False)
+
+    def start( self ):
+        for album in self.albums: self.action._prepareAlbum(album)
+        files = [(album, track, f, self.snapshot(f)) for album, track, f in self.files]
+        chunks = [files[i:(i + self.chunkSize)] for i in range(0, len(files), self.chunkSize)]
+        self.pending = len(chunks)
+        if (not chunks): self._finish()
+        for chunk in chunks: thread.run_task(partial(self.profiler.wrap(r'album_chunk', self._run), chunk), self._chunkFinished)
+
+    def _run( self, chunk ):
+        changeSets, failed = [], 0
+        for album, track, f, metadata in chunk:
+            before = list(metadata.rawitems())
+            try: self.action._processAlbumFile(album, track, f, metadata)
+            except Exception as e:
+                log.error(r'{}: cannot process "{}": {}'.format(self.plugin, f.filename, e))
+                failed += 1
+                continue
+            deletions, sets = self.changes(before, metadata.rawitems())
+            if (deletions or sets): changeSets += [(f, (deletions, sets))]
+        return (len(chunk), failed, changeSets)
+
+    def _chunkFinished( self, result=None, error=None ):
+        if (error): log.error(r'{}: album batch chunk failed: {}'.format(self.plugin, error))
+        processed, failed, changeSets = result or (0, 0, [])
+        for f, changes in changeSets: self.action._finish(f, changes)
+        self.done += processed
+        self.failed += failed
+        self.pending -= 1
+        self.action.tagger.window.set_statusbar_message(N_('%(plugin)s: %(done)d of %(total)d files processed'),
+                                                        {r'plugin': self.plugin, r'done': self.done, r'total': len(self.files)})
+        if (self.pending == 0): self._finish()
+
+    def _finish( self ):
+        for album in self.albums: album.update()
+        self.action._albumsFinished(self)
+
+
+
+# What each metapicard plugin's hooks did to the files they saw, shared by all of them through one
+# index in the cache directory: (plugin, hook, path) -> (fingerprint of the input, change-set); the
+# fingerprint covers every tag the hook got (hidden ones included), the length, the plugin's version
+# and options and the caller's context, and a hook getting that same input again replays the
+# change-set instead of processing the file (entries are written in batches and at exit); outcomes
+# the caller's 'keep' rejects (e.g. failed lookups) are not recorded, so they are retried next time;
+# workers pass a snapshot of the file's metadata to be processed instead of the file's own
+class FingerprintIndex():
+
+    commitDelay = 5.0 # seconds
+
+    def __init__( self, plugin, version, options, lifetime=None ):
+        self.plugin = plugin
+        self.version = version
+        self.options = options
+        self.lifetime = lifetime # seconds, for hooks whose results may change over time
+        self.path = os.path.join(cacheDirectory(), r'fingerprints.sqlite')
+        self.lock = Lock()
+        self.connection = None
+        self.entries = {}
+        self.pending = {}
+        self.timer = None
+        atexit.register(self.commit)
+
+    def _open( self ):
+        if (self.connection is None):
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+                self.connection.execute(r'PRAGMA journal_mode=WAL')
+                self.connection.execute(r'PRAGMA synchronous=OFF')
+                self.connection.execute(r'CREATE TABLE IF NOT EXISTS changesets (plugin TEXT, hook TEXT, path TEXT, '
+                                        r'fingerprint TEXT, changes TEXT, recorded REAL, PRIMARY KEY (plugin, hook, path))')
+                rows = self.connection.execute(r'SELECT hook, path, fingerprint, changes, recorded FROM changesets WHERE plugin = ?',
+                                               (self.plugin,))
+                self.entries = {(hook, path): (fingerprint, changes, recorded) for hook, path, fingerprint, changes, recorded in rows}
+            except (OSError, sqlite3.Error) as e:
+                log.warning(r'{}: cannot open fingerprint index "{}": {}'.format(self.plugin, self.path, e))
+                self.connection = False
+        return bool(self.connection)
+
+    def fingerprint( self, metadata, context=None ):
+        salt = (self.version, context, getattr(metadata, r'length', None))
+        salt += tuple(config.setting[option] for option in self.options)
+        digest = hashlib.blake2b(repr(salt).encode(r'utf-8'), digest_size=16)
+        for tagName, values in sorted(metadata.rawitems(), key=(lambda item: item[0])):
+            digest.update(repr((tagName, list(values))).encode(r'utf-8'))
+        return digest.hexdigest()
+
+    def run( self, hook, f, process, context=None, keep=None, metadata=None ):
+        filename = getattr(f, r'filename', None)
+        if (not filename): return process()
+        key, metadata = (hook, os.path.abspath(filename)), (f.metadata if (metadata is None) else metadata)
+        fingerprint = self.fingerprint(metadata, context)
+        with self.lock:
+            entry = self.entries.get(key, None) if (self._open()) else None
+        if ((entry is not None) and (entry[0] == fingerprint)):
+            if ((self.lifetime is None) or ((time() - entry[2]) < self.lifetime)):
+                deletions, sets = json.loads(entry[1])
+                for tagName in deletions: metadata.pop(tagName, None)
+                for tagName, values in sets.items(): metadata[tagName] = values
+                return
+        before = [(tagName, list(values)) for tagName, values in metadata.rawitems()]
+        process()
+        if (keep and (not keep(metadata))): return
+        entry = (fingerprint, json.dumps(AlbumBatch.changes(before, metadata.rawitems())), time())
+        with self.lock:
+            if (not self.connection): return
+            self.entries[key] = entry
+            self.pending[key] = entry
+            if (self.timer is None):
+                self.timer = Timer(self.commitDelay, self.commit)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def commit( self ):
+        with self.lock:
+            self.timer = None
+            pending, self.pending = self.pending, {}
+            if ((not pending) or (not self.connection)): return
+            try:
+                self.connection.executemany(r'INSERT OR REPLACE INTO changesets VALUES (?, ?, ?, ?, ?, ?)',
+                                            [((self.plugin,) + key + entry) for key, entry in pending.items()])
+                self.connection.commit()
+            except sqlite3.Error as e:
+                log.warning(r'{}: cannot update fingerprint index "{}": {}'.format(self.plugin, self.path, e))
@@ -24,20 +24,26 @@ from functools import partial
 
 PLUGIN_NAME = 'No Bonus'
 PLUGIN_AUTHOR = 'Pedro Vernetti G.'
-PLUGIN_DESCRIPTION = "Removes things like '(bonus track)' or '(deluxe)' from title and album tags."
+PLUGIN_DESCRIPTION = "Removes things like '(bonus track)' or '(deluxe)' from title, album and other title-like tags."
 PLUGIN_VERSION = '0.1'
 PLUGIN_API_VERSIONS = ['2.0', '2.1', '2.2', '2.3', '2.4', '2.5', '2.6']
 PLUGIN_LICENSE = 'GPLv3'
 PLUGIN_LICENSE_URL = 'https://www.gnu.org/licenses/gpl-3.0.en.html'
 
 from PyQt5 import QtWidgets
+from picard.config import TextOption
 from picard import config, log
 from picard.file import File, register_file_post_addition_to_track_processor
 from picard.plugin import PluginPriority
 from picard.track import Track
 from picard.album import Album
 from picard.ui.itemviews import BaseAction, register_file_action, register_album_action
-from picard.util import thread
+from picard.ui.options import OptionsPage, register_options_page
+from picard.plugins.metapicardcommon import AlbumBatch, FingerprintIndex, Profiler
+
+
+
+_profiler = Profiler(PLUGIN_NAME)
 
 
 
@@ -51,33 +57,83 @@ class NoBonus( BaseAction ):
     _ext = r'extended(\s*(version|edition|release|dis[ck]))?'
     _outtake = r'(studio\s*)?outtake'
 
-    _forTitle = r'[(\[](' + _bonus + r'|' + _std + r'|' + _deluxe + r'|' + _outtake + r')[)\]]'
-    _forAlbum = r'[(\[](' + _bonus + r'|' + _std + r'|' + _deluxe + r'|' + _ext + r')[)\]]'
+    _forTitle = ( _bonus, _std, _deluxe, _outtake, )
+    _forAlbum = ( _bonus, _std, _deluxe, _ext, )
 
-    _title = re.compile((r'\s+' + _forTitle + '\s*$'), re.IGNORECASE)
-    _titlesort = re.compile((r'\s+' + _forAlbum + '\)\s*(, \w+\s*)?$'), re.IGNORECASE)
-    _album = re.compile((r'\s+' + _forTitle + '\s*$'), re.IGNORECASE)
+    _options = ( r'bonusTargetTags', r'bonusTitlePhrases', r'bonusAlbumPhrases', )
+    _fingerprints = FingerprintIndex(PLUGIN_NAME, PLUGIN_VERSION, _options)
+    _defaultTargets = r'title; titlesort; work; album; albumsort; discsubtitle; ~releasegroup'
+    # rule family: (built-in phrases, option holding the user's phrases)
+    _families = { r'title': (_forTitle, r'bonusTitlePhrases'),
+                  r'album': (_forAlbum, r'bonusAlbumPhrases'), }
+    _albumLike = re.compile(r'album|release|disc')
+    _targetSeparators = re.compile(r'[\s,;]+')
 
     _emptyPar = re.compile(r'\s*\(\)')
 
+    _rules = None
+    _rulesFingerprint = None
+    _cleanMemo = {}
+    _cleanMemoLimit = 4096
+
     def __init__( self ):
         super().__init__()
 
+    @classmethod
+    def _family( cls, tagName ):
+        tagName = tagName.casefold()
+        return ((r'album' if cls._albumLike.search(tagName) else r'title'), tagName.endswith(r'sort'))
+
+    @classmethod
+    def _compileRules( cls ):
+        setting = {option: config.setting[option] for option in cls._options}
+        fingerprint = tuple(setting[option] for option in cls._options)
+        if ((cls._rules is not None) and (fingerprint == cls._rulesFingerprint)): return
+        compiled, rules = {}, {}
+        for tagName in cls._targetSeparators.split(setting[r'bonusTargetTags']):
+            if (not tagName): continue
+            family = cls._family(tagName)
+            if (family not in compiled):
+                phrases, option = cls._families[family[0]]
+                phrases = r'|'.join(list(phrases) + cls._userPhrases(setting[option]))
+                article = r'(?P<article>,\s*\w+)?' if family[1] else r'(?P<article>)'
+                compiled[family] = re.compile((r'\s+[(\[](' + phrases + r')[)\]]' + article + r'\s*$'), re.IGNORECASE)
+            rules[tagName] = (family, compiled[family])
+        cls._rules = rules
+        cls._rulesFingerprint = fingerprint
+        cls._cleanMemo = {}
+
+    @classmethod
+    def _userPhrases( cls, text ):
+        return [r'\s*'.join(re.escape(word) for word in line.split()) for line in text.splitlines() if line.strip()]
+
+    def _clean( self, family, rule, value ):
+        cleaned = self._cleanMemo.get((family, value), None)
+        if (cleaned is None):
+            if (len(self._cleanMemo) >= self._cleanMemoLimit): self._cleanMemo.clear()
+            if ((r'(' in value) or (r'[' in value)):
+                cleaned = self._emptyPar.sub(r'', rule.sub(r'\g<article>', value).strip())
+            else:
+                cleaned = value.strip()
+            self._cleanMemo[(family, value)] = cleaned
+        return cleaned
+
     def process( self, album, metadata, track, release ):
-        title = self._title.sub(r'', metadata.get(r'title', r'')).strip()
-        titlesort = self._titlesort.sub(r'', metadata.get(r'titlesort', r'')).strip()
-        album = self._album.sub(r'', metadata.get(r'album', r'')).strip()
-        metadata[r'title'] = self._emptyPar.sub(r'', title)
-        metadata[r'titlesort'] = self._emptyPar.sub(r'', titlesort)
-        metadata[r'album'] = self._emptyPar.sub(r'', album)
+        if (self._rules is None): self._compileRules()
+        for tagName, (family, rule) in self._rules.items():
+            values = metadata.getall(tagName)
+            if (not values): continue
+            cleaned = [self._clean(family, rule, value) for value in values]
+            if (cleaned != values): metadata[tagName] = cleaned
 
     def _finish( self, file, result=None, error=None ):
-        pass
+        if (result): AlbumBatch.apply(file, result)
 
     def processFile( self, track, file ):
-        self.process(None, file.metadata, track, None)
+        self._fingerprints.run(r'file_post_addition_to_track', file, partial(self.process, None, file.metadata, track, None))
 
     def callback( self, objs ):
+        self._compileRules()
         for obj in objs:
             if (isinstance(obj, Track)):
                 for f in obj.linked_files: self.process(None, f.metadata, obj, None)
@@ -93,16 +149,66 @@ class NoBonusForAlbums( NoBonus ):
     def __init__( self ):
         super().__init__()
 
-    def callback( self, objs ):
-        for obj in objs:
-            if (isinstance(obj, Album)):
-                for track in obj.tracks:
-                    for f in track.linked_files:
-                        thread.run_task(partial(super().process, None, f.metadata, obj, None),
-                                partial(super()._finish, f))
+    def _prepareAlbum( self, album ):
+        self._compileRules()
 
+    def _processAlbumFile( self, album, track, f, metadata ):
+        self.process(album, metadata, track, None)
 
+    def _albumsFinished( self, batch ):
+        pass
 
-register_file_action(NoBonus())
-register_file_post_addition_to_track_processor(NoBonus().processFile, priority=PluginPriority.LOW)
-register_album_action(NoBonusForAlbums())
+    def callback( self, objs ):
+        AlbumBatch(self, [obj for obj in objs if (isinstance(obj, Album))], _profiler).start()
+
+
+
+class NoBonusOptionsPage( OptionsPage ):
+
+    NAME = PLUGIN_NAME.casefold()
+    TITLE = PLUGIN_NAME
+    PARENT = r'tags'
+
+    options = [ TextOption(r'setting', r'bonusTargetTags', NoBonus._defaultTargets),
+                TextOption(r'setting', r'bonusTitlePhrases', r''),
+                TextOption(r'setting', r'bonusAlbumPhrases', r'') ]
+
+    def __init__( self, parent=None ):
+        super().__init__(parent)
+        self.box = QtWidgets.QVBoxLayout(self)
+        self.targetTagsLabel = QtWidgets.QLabel(self)
+        self.targetTagsLabel.setText(r'Tags to clean (sort tags keep their trailing article; album/release/disc tags use the album phrases)')
+        self.box.addWidget(self.targetTagsLabel)
+        self.targetTagsInput = QtWidgets.QLineEdit(self)
+        self.targetTagsInput.setText(NoBonus._defaultTargets)
+        self.box.addWidget(self.targetTagsInput)
+        self.titlePhrasesLabel = QtWidgets.QLabel(self)
+        self.titlePhrasesLabel.setText(r'Also purge these parenthesized/bracketed title endings (one phrase per line)')
+        self.box.addWidget(self.titlePhrasesLabel)
+        self.titlePhrasesInput = QtWidgets.QPlainTextEdit(self)
+        self.box.addWidget(self.titlePhrasesInput)
+        self.albumPhrasesLabel = QtWidgets.QLabel(self)
+        self.albumPhrasesLabel.setText(r'Also purge these parenthesized/bracketed album endings (one phrase per line)')
+        self.box.addWidget(self.albumPhrasesLabel)
+        self.albumPhrasesInput = QtWidgets.QPlainTextEdit(self)
+        self.box.addWidget(self.albumPhrasesInput)
+        self.spacer = QtWidgets.QSpacerItem(0, 0, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
+        self.box.addItem(self.spacer)
+
+    def load( self ):
+        self.targetTagsInput.setText(config.setting[r'bonusTargetTags'])
+        self.titlePhrasesInput.setPlainText(config.setting[r'bonusTitlePhrases'])
+        self.albumPhrasesInput.setPlainText(config.setting[r'bonusAlbumPhrases'])
+
+    def save( self ):
+        config.setting[r'bonusTargetTags'] = self.targetTagsInput.text()
+        config.setting[r'bonusTitlePhrases'] = self.titlePhrasesInput.toPlainText()
+        config.setting[r'bonusAlbumPhrases'] = self.albumPhrasesInput.toPlainText()
+        NoBonus._compileRules()
+
+
+
+register_file_action(_profiler.action(r'file_action', NoBonus()))
+register_file_post_addition_to_track_processor(_profiler.wrap(r'file_post_addition_to_track', NoBonus().processFile), priority=PluginPriority.LOW)
+register_album_action(_profiler.action(r'album_action', NoBonusForAlbums()))
+register_options_page(NoBonusOptionsPage)
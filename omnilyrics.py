@@ -18,8 +18,11 @@
 # #  ...then place it at: ~/.config/MusicBrainz/Picard/plugins
 # =============================================================================================
 
-import re, time, requests
+import os, re, json, time, zlib, atexit, hashlib, tempfile, requests
+from threading import Lock, Thread, Event, Timer
+from collections import deque
 from random import shuffle
+from heapq import nlargest
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, quote as urlquote
 from unidecode import unidecode
@@ -45,7 +48,7 @@ PLUGIN_LICENSE_URL = 'https://www.gnu.org/licenses/gpl-3.0.en.html'
 if (not (__name__ == "__main__")):
     runningAsPlugin = True
     from functools import partial
-    from PyQt5 import QtWidgets
+    from PyQt5 import QtCore, QtWidgets
     from picard import config, log
     from picard.config import TextOption, BoolOption
     from picard.file import File, register_file_post_addition_to_track_processor
@@ -56,6 +59,7 @@ if (not (__name__ == "__main__")):
     from picard.ui.itemviews import BaseAction, register_file_action, register_track_action, register_album_action
     from picard.ui.options import OptionsPage, register_options_page
     from picard.util import thread
+    from picard.plugins.metapicardcommon import AlbumBatch, FingerprintIndex, Profiler
 else:
     BaseAction = object
     runningAsPlugin = False
@@ -307,28 +311,465 @@ def _glamShamScraper( page, normArtist, normTitle ):
 
 
 
-def _letrasURL( artist, title ):
-    artistURL = re.sub(r'[^\w\s/-]', r'', unidecode(artist.casefold())).replace(r'&', r'e')
-    artistURL = r'https://www.letras.mus.br/' + re.sub(r'[\s/-]+', r'-', artistURL).strip(r'-') + r'/'
-    try: artistPage = requests.get(artistURL, headers=OmniLyrics.headers)
-    except: return None
-    if (not artistPage): return None
-    artistPage = BeautifulSoup(artistPage.content, r'lxml')
+def _cacheDirectory():
+    cacheHome = os.environ.get(r'XDG_CACHE_HOME', r'') or os.path.join(os.path.expanduser(r'~'), r'.cache')
+    return os.path.join(cacheHome, r'metapicard')
+
+class _NegativeCache():
+
+    urlLifetime = 30 * 86400
+    hostLifetime = 86400
+    hostFailuresToDeath = 3
+    saveDelay = 30.0 # seconds; changes are also saved at exit
+
+    def __init__( self, path ):
+        self.path = path
+        self.expiry = {}
+        self.hostFailures = {}
+        self.dirty = False
+        self.timer = None
+        self.lock = Lock()
+        self._load()
+        atexit.register(self.save)
+
+    def _add( self, key, lifetime ):
+        self.expiry[key] = time.time() + lifetime
+        self.dirty = True
+        if (self.timer is None):
+            self.timer = Timer(self.saveDelay, self.save)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _isDead( self, key ):
+        expiry = self.expiry.get(key, 0)
+        if (expiry > time.time()): return True
+        if (expiry):
+            with self.lock:
+                self.expiry.pop(key, None)
+                self.dirty = True
+        return False
+
+    def isDead( self, url ):
+        return (self._isDead(r'host:' + urlparse(url).netloc) or self._isDead(r'url:' + url))
+
+    def markDead( self, url ):
+        with self.lock: self._add((r'url:' + url), self.urlLifetime)
+
+    def markUnreachable( self, url ):
+        host = urlparse(url).netloc
+        with self.lock:
+            self.hostFailures[host] = self.hostFailures.get(host, 0) + 1
+            if (self.hostFailures[host] >= self.hostFailuresToDeath):
+                self.hostFailures.pop(host, None)
+                self._add((r'host:' + host), self.hostLifetime)
+
+    def markReachable( self, url ):
+        if (self.hostFailures): self.hostFailures.pop(urlparse(url).netloc, None)
+
+    def _load( self ):
+        try:
+            with open(self.path, r'r') as cacheFile: cached = json.load(cacheFile)
+        except:
+            return
+        now = time.time()
+        self.expiry = {key: expiry for key, expiry in cached.get(r'expiry', {}).items() if (expiry > now)}
+
+    def save( self ):
+        with self.lock:
+            self.timer = None
+            if (not self.dirty): return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open((self.path + r'.tmp'), r'w') as cacheFile:
+                    json.dump({r'expiry': self.expiry}, cacheFile)
+                os.replace((self.path + r'.tmp'), self.path)
+                self.dirty = False
+            except OSError:
+                pass
+
+_deadURLs = _NegativeCache(os.path.join(_cacheDirectory(), r'omnilyrics-dead-urls.json'))
+
+class _CachedPage():
+
+    status_code = 200
+    ok = True
+
+    def __init__( self, url, header, compressedContent ):
+        self.url = url
+        self.header = header
+        self.headers = header.get(r'headers', {})
+        self.compressedContent = compressedContent
+        self._content = None
+
+    def __bool__( self ):
+        return True
+
+    @property
+    def content( self ):
+        if (self._content is None): self._content = zlib.decompress(self.compressedContent)
+        return self._content
+
+    def json( self ):
+        return json.loads(self.content)
+
+    def isFresh( self ):
+        return (self.header.get(r'expires', 0) > time.time())
+
+    def validators( self ):
+        validators = {}
+        if (r'ETag' in self.headers): validators[r'If-None-Match'] = self.headers[r'ETag']
+        if (r'Last-Modified' in self.headers): validators[r'If-Modified-Since'] = self.headers[r'Last-Modified']
+        return validators
+
+class _PageCache():
+
+    defaultLifetime = 7 * 86400
+    minimumLifetime = 86400 # for short max-ages, not for pages that must be revalidated
+    sizeLimit = 64 << 20 # least recently used pages go first
+    _keptHeaders = (r'ETag', r'Last-Modified', r'Content-Type')
+
+    def __init__( self, directory ):
+        self.directory = directory
+        self.size = None
+        self.lock = Lock()
+
+    def _path( self, url ):
+        return os.path.join(self.directory, (hashlib.sha1(url.encode(r'utf-8')).hexdigest() + r'.z'))
+
+    def _lifetime( self, headers ):
+        cacheControl = headers.get(r'Cache-Control', r'').casefold()
+        if (r'no-store' in cacheControl): return None
+        if ((r'no-cache' in cacheControl) or (r'private' in cacheControl)): return 0
+        maxAge = re.search(r'\bmax-age\s*=\s*([0-9]+)', cacheControl)
+        if (not maxAge): return self.defaultLifetime
+        return max(int(maxAge.group(1)), self.minimumLifetime) if (int(maxAge.group(1))) else 0
+
+    def _entries( self ):
+        entries = []
+        try:
+            for entry in os.scandir(self.directory):
+                try: status = entry.stat()
+                except OSError: continue
+                entries += [(status.st_mtime, status.st_size, entry.path)]
+        except OSError:
+            pass
+        return entries
+
+    def _grown( self, written ):
+        with self.lock:
+            if (self.size is not None): self.size += written
+            if ((self.size is not None) and (self.size <= self.sizeLimit)): return
+            entries = self._entries()
+            self.size = sum(size for modified, size, path in entries)
+            for modified, size, path in sorted(entries):
+                if (self.size <= (self.sizeLimit * 0.9)): break
+                try: os.remove(path)
+                except OSError: continue
+                self.size -= size
+
+    def _write( self, page ):
+        content = json.dumps(page.header).encode(r'utf-8') + b'\n' + page.compressedContent
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            descriptor, temporaryPath = tempfile.mkstemp(suffix=r'.tmp', dir=self.directory)
+            try:
+                with os.fdopen(descriptor, r'wb') as pageFile: pageFile.write(content)
+                os.replace(temporaryPath, self._path(page.url))
+            except OSError:
+                os.remove(temporaryPath)
+                raise
+        except OSError:
+            return
+        self._grown(len(content))
+
+    def get( self, url ):
+        path = self._path(url)
+        try:
+            with open(path, r'rb') as pageFile:
+                header = json.loads(pageFile.readline())
+                compressedContent = pageFile.read()
+            os.utime(path) # recently used
+        except:
+            return None
+        if (header.get(r'url', None) != url): return None
+        return _CachedPage(url, header, compressedContent)
+
+    def store( self, url, response ):
+        lifetime = self._lifetime(response.headers)
+        if (lifetime is None): return
+        kept = self._keptHeaders if (getattr(response, r'complete', True)) else (r'Content-Type',)
+        headers = {name: response.headers[name] for name in kept if (name in response.headers)}
+        if ((not lifetime) and (r'ETag' not in headers) and (r'Last-Modified' not in headers)): return # useless
+        header = {r'url': url, r'expires': (time.time() + lifetime), r'headers': headers}
+        self._write(_CachedPage(url, header, zlib.compress(response.content, 6)))
+
+    def revalidated( self, url, page, headers ):
+        lifetime = self._lifetime(headers)
+        if (lifetime is None): lifetime = 0
+        page.header[r'expires'] = time.time() + lifetime
+        for name in (r'ETag', r'Last-Modified'):
+            if (name in headers): page.headers[name] = headers[name]
+        page.header[r'headers'] = page.headers
+        self._write(page)
+        return page
+
+_pageCache = _PageCache(os.path.join(_cacheDirectory(), r'omnilyrics-pages'))
+
+class _DownloadedPage():
+
+    # complete: whole body read; truncated: cut by the size limit or the connection (never cached);
+    # else the download stopped once the lyrics went by (cached, but without the full page's validators)
+    def __init__( self, url, status_code, headers, content, complete=True, truncated=False ):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.complete = complete
+        self.truncated = truncated
+
+    def __bool__( self ):
+        return (self.status_code < 400)
+
+    def json( self ):
+        return json.loads(self.content)
+
+_timeout = (10, 30)
+_acceptedContentTypes = { r'text/html', r'application/xhtml+xml', r'text/plain', r'application/json', }
+_pageSizeLimits = { r'genius': (4 << 20), r'darklyrics': (4 << 20), } # default: 2 MiB
+
+# (lyrics container start, end): downloads stop once both went by
+_pageEndMarkers = { r'azlyrics':       (b'<!-- Usage of azlyrics.com content', b'</div>'),
+                    r'www.lyrics.com': (b'id="lyric-body-text"', b'</pre>'), }
+
+def _download( url, params=None, headers=None ):
+    netloc = urlparse(url).netloc
+    limit = next((size for domain, size in _pageSizeLimits.items() if (domain in netloc)), (2 << 20))
+    startMarker, endMarker = next((markers for domain, markers in _pageEndMarkers.items() if (domain in netloc)), (None, None))
+    with requests.get(url, params=params, headers=headers, stream=True, timeout=_timeout) as response:
+        if (response.status_code != 200):
+            return _DownloadedPage(url, response.status_code, response.headers, b'')
+        contentType = response.headers.get(r'Content-Type', r'').split(r';')[0].strip().casefold()
+        if (contentType and (contentType not in _acceptedContentTypes)):
+            return _DownloadedPage(url, 415, response.headers, b'')
+        body = bytearray()
+        start = -1
+        complete, truncated = True, False
+        for chunk in response.iter_content(chunk_size=16384):
+            searchFrom = max(0, (len(body) - 64))
+            body += chunk
+            if (len(body) >= limit):
+                del body[limit:]
+                complete, truncated = False, True
+                break
+            if (startMarker):
+                if (start < 0): start = body.find(startMarker, searchFrom)
+                if ((start >= 0) and (body.find(endMarker, max(start, searchFrom)) >= 0)):
+                    complete = False
+                    break
+        expected = response.headers.get(r'Content-Length', r'')
+        if (complete and expected.isdigit() and (not response.headers.get(r'Content-Encoding', None))):
+            truncated = (len(body) < int(expected))
+            complete = not truncated
+        return _DownloadedPage(url, 200, response.headers, bytes(body), complete, truncated)
+
+def _get( url, params=None, headers=None, cached=None ):
+    if (params): return _download(url, params=params, headers=headers)
+    cached = cached or _pageCache.get(url)
+    if (cached):
+        if (cached.isFresh()): return cached
+        headers = dict((headers or {}), **cached.validators())
+    response = _download(url, headers=headers)
+    if ((response.status_code == 304) and cached): return _pageCache.revalidated(url, cached, response.headers)
+    if ((response.status_code == 200) and (not response.truncated)): _pageCache.store(url, response)
+    return response
+
+# shared by every OmniLyrics instance and worker thread (song indexes of artist pages included)
+_requestFailureHistory = {}
+_lastRequestTimes = {}
+_requestLock = Lock()
+
+def _pacedRequest( url, params=None, headers=None, politeness=1.0 ):
+    cached = None if (params) else _pageCache.get(url)
+    if (cached and cached.isFresh()): return cached # no network access, so neither paced nor held back
+    netloc = urlparse(url).netloc
+    with _requestLock:
+        if (netloc in _requestFailureHistory):
+            failedAt, status = _requestFailureHistory[netloc]
+            if (time.time() <= (failedAt + (3600 if (status == 429) else 60))): return None
+            _requestFailureHistory.pop(netloc, None)
+        now = time.time()
+        requestAt = max(now, (_lastRequestTimes.get(netloc, 0) + politeness))
+        _lastRequestTimes[netloc] = requestAt # taken, so concurrent requests queue up behind it
+    if (requestAt > now): time.sleep(requestAt - now)
+    try:
+        response = _get(url, params=params, headers=headers, cached=cached)
+        status = response.status_code
+        _deadURLs.markReachable(url)
+    except requests.exceptions.ConnectionError:
+        _deadURLs.markUnreachable(url)
+        status = 418
+    except:
+        status = 418
+    if (status in {404, 410}):
+        if (not params): _deadURLs.markDead(url)
+        return None
+    elif (status == 429):
+        with _requestLock: _requestFailureHistory[netloc] = (time.time(), 429)
+        return None
+    elif (status != 200):
+        return None
+        # limit = time.time() + 10
+        # while time.time() <= limit:
+            # try:
+                # response = requests.get(url, params=params, headers=headers)
+                # if (response.status_code == 200):
+                    # status = response.status_code
+                    # break
+                # if (response.status_code == 429):
+                    # _requestFailureHistory[netloc] = (time.time(), 429)
+                    # return None
+            # except:
+                # status = 418
+        # if (status != 200):
+            # _requestFailureHistory[netloc] = (time.time(), response.status_code)
+            # if (not runningAsPlugin): print(r'HTTP ' + str(response.status_code))
+            # return None
+    else:
+        return response
+
+class _LyricsCache():
+
+    missLifetime = 6 * 3600 # songs without lyrics are looked up again after that
+
+    def __init__( self, limit ):
+        self.limit = limit
+        self.entries = {}
+        self.lock = Lock()
+
+    def key( self, artist, title ):
+        return (_normalizedSongTitle(artist), _normalizedSongTitle(title))
+
+    # the lyrics, r'' for a recent miss, or None when unknown
+    def get( self, artist, title ):
+        lyrics, expiry = self.entries.get(self.key(artist, title), (None, None))
+        if (expiry and (expiry < time.time())): return None
+        return lyrics
+
+    def put( self, artist, title, lyrics ):
+        expiry = None if (lyrics) else (time.time() + self.missLifetime)
+        with self.lock:
+            if (len(self.entries) >= self.limit): self.entries.pop(next(iter(self.entries)), None)
+            self.entries[self.key(artist, title)] = ((lyrics or r''), expiry)
+
+_lyricsCache = _LyricsCache(4096)
+
+# artist page URL -> (song title index or None for a failed page, expiry of failures); least recently used first
+_songIndexes = {}
+_songIndexesLimit = 64
+_songIndexesLock = Lock()
+_songIndexMissLifetime = 15 * 60
+
+def _normalizedSongTitle( title ):
+    return re.sub(r'\W', r'', unidecode(title.casefold()))
+
+def _editDistance( a, b ):
+    if (len(a) < len(b)): a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, charA in enumerate(a, 1):
+        current = [i]
+        for j, charB in enumerate(b, 1):
+            current += [min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (charA != charB))]
+        previous = current
+    return previous[-1]
+
+class _SongTitleIndex():
+
+    minConfidence = 0.8
+    numberedConfidence = 0.9 # "01 Title" entries, unless another song fits as well
+    _candidates = 8
+    _numbering = re.compile(r'^[0-9]{1,3}$')
+
+    def __init__( self, songs ):
+        self.titles = []
+        self.urls = []
+        self.exact = {}
+        self.trigrams = {}
+        for title, url in songs:
+            title = _normalizedSongTitle(title)
+            if (not title): continue
+            i = len(self.titles)
+            self.titles += [title]
+            self.urls += [url]
+            self.exact.setdefault(title, i)
+            for trigram in self._trigrams(title): self.trigrams.setdefault(trigram, []).append(i)
+
+    def __len__( self ):
+        return len(self.titles)
+
+    def _trigrams( self, title ):
+        if (len(title) < 3): return {title}
+        return {title[i:(i + 3)] for i in range(len(title) - 2)}
+
+    def lookup( self, title ):
+        title = _normalizedSongTitle(title)
+        if (not title): return (None, 0.0)
+        if (title in self.exact): return (self.urls[self.exact[title]], 1.0)
+        shared = {}
+        for trigram in self._trigrams(title):
+            for i in self.trigrams.get(trigram, ()): shared[i] = shared.get(i, 0) + 1
+        candidates = nlargest(self._candidates, shared, key=lambda i: (shared[i], -i))
+        if (not candidates): # too short (or too garbled) to share trigrams: every title of a length that could fit
+            candidates = [i for i, candidate in enumerate(self.titles)
+                          if ((len(title) * self.minConfidence) <= len(candidate) <= (len(title) / self.minConfidence))]
+        best, tied = (None, 0.0), False
+        for i in candidates:
+            candidate = self.titles[i]
+            if (candidate.endswith(title) and self._numbering.match(candidate[:-len(title)])): confidence = self.numberedConfidence
+            else: confidence = 1.0 - (_editDistance(candidate, title) / max(len(candidate), len(title)))
+            if (confidence > best[1]): best, tied = (self.urls[i], confidence), False
+            elif ((confidence == best[1]) and (self.urls[i] != best[0])): tied = True
+        return ((None, 0.0) if (tied) else best)
+
+    def match( self, title ):
+        url, confidence = self.lookup(title)
+        return url if (confidence >= self.minConfidence) else None
+
+def _cachedSongIndex( artistURL, index, expiry=None ):
+    with _songIndexesLock:
+        _songIndexes.pop(artistURL, None)
+        if (len(_songIndexes) >= _songIndexesLimit): _songIndexes.pop(next(iter(_songIndexes)), None)
+        _songIndexes[artistURL] = (index, expiry)
+    return index
+
+def _songIndex( artistURL, songsFromPage ):
+    with _songIndexesLock:
+        index, expiry = _songIndexes.pop(artistURL, (None, None))
+        if ((index is not None) or (expiry and (expiry > time.time()))):
+            _songIndexes[artistURL] = (index, expiry) # most recently used
+            return index
+    if (_deadURLs.isDead(artistURL)): return None
+    failed = lambda: _cachedSongIndex(artistURL, None, (time.time() + _songIndexMissLifetime))
+    artistPage = _pacedRequest(artistURL, headers=OmniLyrics.headers)
+    if (not artistPage): return failed()
+    songs = songsFromPage(BeautifulSoup(artistPage.content, r'lxml'))
+    if (not songs): return failed()
+    return _cachedSongIndex(artistURL, _SongTitleIndex(songs))
+
+
+
+def _letrasSongs( artistPage ):
     songs = artistPage.find_all(r'a', {r'class': r'song-name'})
     if (not songs):
         songs = artistPage.find_all(r'div', {r'class': r'list-container'})
         if (not songs): return None
         songs = songs[0].find_all(r'a')
-        title = re.sub(r'\W', r'', title.casefold())
-        for song in songs:
-            if (re.sub(r'\W', r'', song.get_text().casefold()).endswith(title)):
-                return (r'https://www.letras.mus.br' + song[r'href'])
-        return None
-    title = re.sub(r'\W', r'', title.casefold())
-    for song in songs:
-        if (re.sub(r'\W', r'', song.get_text().casefold()).endswith(title)):
-            return (r'https://www.letras.mus.br' + song[r'href'])
-    return None
+    return [(song.get_text(), (r'https://www.letras.mus.br' + song[r'href'])) for song in songs]
+
+def _letrasURL( artist, title ):
+    artistURL = re.sub(r'[^\w\s/-]', r'', unidecode(artist.casefold())).replace(r'&', r'e')
+    artistURL = r'https://www.letras.mus.br/' + re.sub(r'[\s/-]+', r'-', artistURL).strip(r'-') + r'/'
+    index = _songIndex(artistURL, _letrasSongs)
+    return index.match(title) if index else None
 
 def _geniusURL( artist, title ):
     artist = unidecode(artist[0].title() + artist[1:].casefold())
@@ -360,21 +801,17 @@ def _vagalumeURL( artist, title ):
     title = re.sub(r'\W+', r'-', unidecode(title.casefold())).strip(r'-')
     return (r'https://www.vagalume.com.br/' + artist + r'/' + title + r'.html')
 
-def _lyricsComURL( artist, title ):
-    artistURL = urlquote(re.sub(r'\s+', r'-', artist.strip()))
-    artistURL = r'https://www.lyrics.com/artist/' + artistURL
-    try: artistPage = requests.get(artistURL, headers=OmniLyrics.headers)
-    except: return None
-    if (not artistPage): return None
-    artistPage = BeautifulSoup(artistPage.content, r'lxml')
+def _lyricsComSongs( artistPage ):
     songs = artistPage.find_all(r'a')
     if (not songs): return None
     songs = [songs[i] for i in range(len(songs)-1, -1, -1) if (songs[i].get(r'href', r'').startswith(r'/lyric/'))]
-    title = re.sub(r'\W', r'', title.casefold())
-    for song in songs:
-        if (re.sub(r'\W', r'', song.get_text().casefold()).endswith(title)):
-            return (r'https://www.lyrics.com' + song[r'href'])
-    return None
+    return [(song.get_text(), (r'https://www.lyrics.com' + song[r'href'])) for song in songs]
+
+def _lyricsComURL( artist, title ):
+    artistURL = urlquote(re.sub(r'\s+', r'-', artist.strip()))
+    artistURL = r'https://www.lyrics.com/artist/' + artistURL
+    index = _songIndex(artistURL, _lyricsComSongs)
+    return index.match(title) if index else None
 
 def _lyricsManiaURL( artist, title ):
     artist = re.sub(r'\s+', r'_', unidecode(artist.casefold().replace(r'&', r'and')))
@@ -388,22 +825,20 @@ def _metroLyricsURL( artist, title ):
     title = re.sub(r'\s+', r'-', re.sub(r'[^\w\s]', r'', unidecode(title.casefold())))
     return (r'https://www.metrolyrics.com/' + title.strip(r'-') + r'-' + artist.strip(r'-') + r'.html')
 
+def _darkLyricsSongs( artistPage ):
+    songs = []
+    for album in artistPage.find_all(r'div', {r'class': r'album'}):
+        if (album.get_text().strip().casefold().startswith(r'album:')):
+            for a in album.find_all(r'a'):
+                songs += [(a.get_text(), re.sub(r'#.*$', r'', (r'http://www.darklyrics.com/' + a[r'href'][3:])))]
+    return songs
+
 def _darkLyricsURL( artist, title ):
     artistURL = re.sub(r'[^a-z0-9]', r'', artist.casefold())
     initial = artistURL[0] if (artistURL[0] in r'abcdefghijklmnopqrstuvwxyz') else r'19'
     artistURL = r'http://www.darklyrics.com/' + initial + r'/' + artistURL + r'.html'
-    try: artistPage = requests.get(artistURL, headers=OmniLyrics.headers)
-    except: return None
-    if (not artistPage): return None
-    artistPage = BeautifulSoup(artistPage.content, r'lxml')
-    albums = artistPage.find_all(r'div', {r'class': r'album'})
-    title = re.sub(r'\W', r'', title.casefold())
-    for album in albums:
-        if (album.get_text().strip().casefold().startswith(r'album:')):
-            for a in album.find_all(r'a'):
-                if (re.sub(r'\W', r'', a.get_text().casefold()).endswith(title)):
-                    return re.sub(r'#.*$', r'', (r'http://www.darklyrics.com/' + a[r'href'][3:]))
-    return None
+    index = _songIndex(artistURL, _darkLyricsSongs)
+    return index.match(title) if index else None
 
 
 
@@ -440,54 +875,16 @@ class OmniLyrics( BaseAction ):
                 r'Referer': r'https://www.google.com/',
                 r'Accept': r'text/html,application/xhtml+xml', }
 
+    politeness = 1.0 # minimum seconds between requests to the same host
+
     def __init__( self ):
         super().__init__()
         if (not runningAsPlugin):
             self.gcsAPIKey = environ.get(r'GCS_API_KEY', None)
             self.gcsEngineID = environ.get(r'GCS_ENGINE_ID', None)
-        self.requestFailureHistory = {}
 
     def _request( self, url, params=None, headers=None ):
-        netloc = urlparse(url).netloc
-        if (netloc in self.requestFailureHistory):
-            if (self.requestFailureHistory[netloc][1] == 429):
-                if (time.time() > (self.requestFailureHistory[netloc][0] + 3600)):
-                    self.requestFailureHistory.pop(netloc, None)
-                else:
-                    return None
-            else:
-                if (time.time() > (self.requestFailureHistory[netloc][0] + 60)):
-                    self.requestFailureHistory.pop(netloc, None)
-                else:
-                    return None
-        try:
-            response = requests.get(url, params=params, headers=headers)
-            status = response.status_code
-        except:
-            status = 418
-        if (status == 429):
-            self.requestFailureHistory[netloc] = (time.time(), 429)
-            return None
-        elif (status != 200):
-            return None
-            # limit = time.time() + 10
-            # while time.time() <= limit:
-                # try:
-                    # response = requests.get(url, params=params, headers=headers)
-                    # if (response.status_code == 200):
-                        # status = response.status_code
-                        # break
-                    # if (response.status_code == 429):
-                        # self.requestFailureHistory[netloc] = (time.time(), 429)
-                        # return None
-                # except:
-                    # status = 418
-            # if (status != 200):
-                # self.requestFailureHistory[netloc] = (time.time(), response.status_code)
-                # if (not runningAsPlugin): print(r'HTTP ' + str(response.status_code))
-                # return None
-        else:
-            return response
+        return _pacedRequest(url, params, headers, self.politeness)
 
     def _query( self, song, language ):
         if (runningAsPlugin):
@@ -554,6 +951,7 @@ class OmniLyrics( BaseAction ):
         for urlRecipe in urlRecipes:
             url = urlRecipe(artist, title)
             if (not ((type(url) == str) and len(url))): continue
+            if (_deadURLs.isDead(url)): continue
             lyrics = self._lyrics(url, normArtist, normTitle)
             if (lyrics):
                 if (not runningAsPlugin):
@@ -582,8 +980,11 @@ class OmniLyrics( BaseAction ):
             lang = iso639.languages.part3.get(language, iso639.languages.part3[r'und']).name
             lang = language + r' (' + lang + r')'
             print('\n TITLE:    ', title, '\n ARTIST:   ', artist, '\n LANGUAGE: ', lang, '\n')
+        lyrics = _lyricsCache.get(artist, title)
+        if (lyrics is not None): return lyrics
         lyrics = self._fetchDirectly(artist, title, language)
         if (not lyrics): lyrics = self._fetchThroughGCS(artist, title, language)
+        _lyricsCache.put(artist, title, lyrics)
         return lyrics
 
     def _fixedLanguage( self, language ):
@@ -676,10 +1077,21 @@ class OmniLyrics( BaseAction ):
         lyrics = re.sub(r'\n\n+', r'\n\n', lyrics, flags=re.MULTILINE)
         return lyrics.strip()
 
-    def process( self, album, metadata, track, release, action=False ):
+    def _language( self, metadata ):
         language = metadata.get(r'language', metadata.get(r'~releaselanguage', r'und')).strip().casefold()
         if (language not in iso639.languages.part3):
             language = self._fixedLanguage(language)
+        return language
+
+    def _artistAndTitle( self, metadata ):
+        artist = metadata.get(r'artist', metadata.get(r'albumartist', None))
+        if (not artist):
+            artist = metadata.get(r'artistsort', metadata.get(r'albumartistsort', None))
+        title = metadata.get(r'title', metadata.get(r'_recordingtitle', metadata.get(r'work', None)))
+        return (artist, title)
+
+    def process( self, album, metadata, track, release, action=False ):
+        language = self._language(metadata)
         if (language == r'und'):
             metadata.pop(r'language', None)
         else:
@@ -698,12 +1110,12 @@ class OmniLyrics( BaseAction ):
                 nonstandardLyricsTags += [key]
         for tagName in nonstandardLyricsTags: metadata.pop(tagName, None)
         if ((language != r'zxx') and (action or ((not lyrics) and config.setting[r'autoFetch']))):
-            artist = metadata.get(r'artist', metadata.get(r'albumartist', None))
-            if (not artist):
-                artist = metadata.get(r'artistsort', metadata.get(r'albumartistsort', None))
-            title = metadata.get(r'title', metadata.get(r'_recordingtitle', metadata.get(r'work', None)))
+            artist, title = self._artistAndTitle(metadata)
             fetchedLyrics = self.fetchLyrics(artist, title, language)
             if (len(fetchedLyrics)): lyrics = fetchedLyrics
+        elif (not lyrics):
+            artist, title = self._artistAndTitle(metadata)
+            if (artist and title): lyrics = _lyricsCache.get(artist, title) or r'' # prefetched
         if (re.sub(r'\W', r'', unidecode(lyrics.casefold())) == r'instrumental'):
             metadata[r'lyrics'] = r'[instrumental]'
             metadata[r'language'] = r'zxx'
@@ -717,6 +1129,7 @@ class OmniLyrics( BaseAction ):
         metadata[r'lyrics'] = lyrics
 
     def _finish( self, file, result=None, error=None ):
+        if (result): AlbumBatch.apply(file, result)
         if not error:
             self.tagger.window.set_statusbar_message(
                 N_('Lyrics for "%(filename)s" successfully fetched/updated.'),
@@ -728,26 +1141,101 @@ class OmniLyrics( BaseAction ):
                 {r'filename': re.sub(r'^.*/', r'', file.filename)}
             )
 
+    # workers process a snapshot of the file's metadata and return a change-set, which _finish applies on the main thread
+    def _runTask( self, album, track, release, action, file, hook=None ):
+        metadata = AlbumBatch.snapshot(file)
+        thread.run_task(partial(self._changes, album, track, release, action, file, metadata, hook), partial(self._finish, file))
+
+    def _changes( self, album, track, release, action, file, metadata, hook ):
+        before = list(metadata.rawitems())
+        process = partial(self.process, album, metadata, track, release, action)
+        if (hook): _fingerprints.run(hook, file, process, keep=self._foundLyrics, metadata=metadata)
+        else: process()
+        return AlbumBatch.changes(before, metadata.rawitems())
+
+    # a lookup that found nothing is not replayed, so it is retried (and prefetched lyrics get picked up)
+    def _foundLyrics( self, metadata ):
+        return bool(metadata.get(r'lyrics', r'').strip())
+
     def processTrack( self, album, metadata, track, release ):
         if (track.is_linked()):
-            for f in track.linked_files:
-                thread.run_task(partial(self.process, album, f.metadata, track, release, False), partial(self._finish, f))
+            for f in track.linked_files: self._runTask(album, track, release, False, f)
 
     def processFile( self, track, file ):
-        thread.run_task(partial(self.process, None, file.metadata, track, None, False), partial(self._finish, file))
+        self._runTask(None, track, None, False, file, r'file_post_addition_to_track')
+
+    def prefetchTrack( self, album, metadata, track, release ):
+        if (not config.setting[r'prefetchLyrics']): return
+        if (metadata.get(r'lyrics', r'') or (self._language(metadata) == r'zxx')): return
+        artist, title = self._artistAndTitle(metadata)
+        if (artist and title): _LyricsPrefetcher.instance().enqueue(artist, title, self._language(metadata))
 
     def callback( self, objs ):
         for obj in objs:
             if (isinstance(obj, Track)):
-                for f in obj.linked_files:
-                    thread.run_task(partial(self.process, None, f.metadata, obj, None, True), partial(self._finish, f))
+                for f in obj.linked_files: self._runTask(None, obj, None, True, f)
             elif (isinstance(obj, File)):
-                thread.run_task(partial(self.process, None, obj.metadata, None, None, True), partial(self._finish, obj))
+                self._runTask(None, None, None, True, obj)
 
 
 
 if (runningAsPlugin):
 
+    _fingerprints = FingerprintIndex(PLUGIN_NAME, PLUGIN_VERSION, (r'autoFetch', r'gcsEngineID'), lifetime=(30 * 86400))
+    _profiler = Profiler(PLUGIN_NAME)
+
+
+
+    class _LyricsPrefetcher( Thread ):
+
+        _instance = None
+        _instanceLock = Lock()
+        busyPause = 2.0
+        politeness = 3.0
+
+        def __init__( self ):
+            super().__init__(daemon=True)
+            self.queue = deque()
+            self.queued = set()
+            self.wakeUp = Event()
+            self.omnilyrics = OmniLyrics()
+            self.omnilyrics.politeness = self.politeness
+
+        @classmethod
+        def instance( cls ):
+            with cls._instanceLock:
+                if (cls._instance is None):
+                    cls._instance = cls()
+                    cls._instance.start()
+            return cls._instance
+
+        def enqueue( self, artist, title, language ):
+            key = _lyricsCache.key(artist, title)
+            if ((key in self.queued) or (_lyricsCache.get(artist, title) is not None)): return
+            self.queued.add(key)
+            self.queue.append((key, artist, title, language))
+            self.wakeUp.set()
+
+        def _busy( self ):
+            threadPool = getattr(QtCore.QCoreApplication.instance(), r'thread_pool', None)
+            if (threadPool is None): return False
+            return (threadPool.activeThreadCount() >= threadPool.maxThreadCount())
+
+        def run( self ):
+            while True:
+                self.wakeUp.wait()
+                self.wakeUp.clear()
+                while self.queue:
+                    if (self._busy()):
+                        time.sleep(self.busyPause)
+                        continue
+                    key, artist, title, language = self.queue.popleft()
+                    try: self.omnilyrics.fetchLyrics(artist, title, language)
+                    except Exception as e: log.debug(r'{}: prefetch failed for "{}": {}'.format(PLUGIN_NAME, title, e))
+                    self.queued.discard(key)
+
+
+
     class OmniLyricsForAlbums( OmniLyrics ):
 
         NAME = "Fetch/Update Lyrics"
@@ -755,12 +1243,25 @@ if (runningAsPlugin):
         def __init__( self ):
             super().__init__()
 
+        def _prepareAlbum( self, album ):
+            pass
+
+        def _processAlbumFile( self, album, track, f, metadata ):
+            self.process(album, metadata, track, None, True)
+
+        def _finish( self, file, result=None, error=None ):
+            if (result): AlbumBatch.apply(file, result)
+
+        def _albumsFinished( self, batch ):
+            if (batch.failed):
+                self.tagger.window.set_statusbar_message(N_('Could not fetch/update lyrics for %(failed)d of %(total)d files.'),
+                                                         {r'failed': batch.failed, r'total': len(batch.files)})
+            else:
+                self.tagger.window.set_statusbar_message(N_('Lyrics for %(total)d files successfully fetched/updated.'),
+                                                         {r'total': len(batch.files)})
+
         def callback( self, objs ):
-            for obj in objs:
-                if (isinstance(obj, Album)):
-                    for track in obj.tracks:
-                        for f in track.linked_files:
-                            thread.run_task(partial(super().process, None, f.metadata, obj, None, True), partial(super()._finish, f))
+            AlbumBatch(self, [obj for obj in objs if (isinstance(obj, Album))], _profiler, chunkSize=2).start()
 
 
 
@@ -772,7 +1273,8 @@ if (runningAsPlugin):
 
         options = [TextOption(r'setting', r'gcsAPIKey', r''),
                    TextOption(r'setting', r'gcsEngineID', r''),
-                   BoolOption(r'setting', r'autoFetch', False)]
+                   BoolOption(r'setting', r'autoFetch', False),
+                   BoolOption(r'setting', r'prefetchLyrics', False)]
 
         def __init__( self, parent=None ):
             super().__init__(parent)
@@ -806,6 +1308,11 @@ if (runningAsPlugin):
             self.autoFetch.setChecked(False)
             self.autoFetch.setText(r'Fetch lyrics from the web automatically after scanning')
             self.box.addWidget(self.autoFetch)
+            self.prefetchLyrics = QtWidgets.QCheckBox(self)
+            self.prefetchLyrics.setCheckable(True)
+            self.prefetchLyrics.setChecked(False)
+            self.prefetchLyrics.setText(r'Prefetch lyrics in the background as soon as an album is loaded')
+            self.box.addWidget(self.prefetchLyrics)
             self.spacer2 = QtWidgets.QSpacerItem(0, 0, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
             self.box.addItem(self.spacer2)
             self.spacer3 = QtWidgets.QSpacerItem(0, 0, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
@@ -815,19 +1322,22 @@ if (runningAsPlugin):
             self.apiKeyInput.setText(config.setting[r'gcsAPIKey'])
             self.idInput.setText(config.setting[r'gcsEngineID'])
             self.autoFetch.setChecked(config.setting[r'autoFetch'])
+            self.prefetchLyrics.setChecked(config.setting[r'prefetchLyrics'])
 
         def save( self ):
             config.setting[r'gcsAPIKey'] = self.apiKeyInput.text()
             config.setting[r'gcsEngineID'] = self.idInput.text()
             config.setting[r'autoFetch'] = self.autoFetch.isChecked()
+            config.setting[r'prefetchLyrics'] = self.prefetchLyrics.isChecked()
 
 
 
-    register_file_action(OmniLyrics())
-    register_file_post_addition_to_track_processor(OmniLyrics().processFile, priority=PluginPriority.LOW)
+    register_file_action(_profiler.action(r'file_action', OmniLyrics()))
+    register_file_post_addition_to_track_processor(_profiler.wrap(r'file_post_addition_to_track', OmniLyrics().processFile), priority=PluginPriority.LOW)
     # register_track_action(OmniLyrics())
     # register_track_metadata_processor(OmniLyrics().processTrack, priority=PluginPriority.LOW)
-    register_album_action(OmniLyricsForAlbums())
+    register_track_metadata_processor(_profiler.wrap(r'track_metadata', OmniLyrics().prefetchTrack), priority=PluginPriority.LOW)
+    register_album_action(_profiler.action(r'album_action', OmniLyricsForAlbums()))
     register_options_page(OmniLyricsOptionsPage)
 
 
@@ -18,7 +18,9 @@
 # =============================================================================================
 
 import re
+from time import perf_counter
 from functools import partial
+from collections import deque
 
 
 
@@ -31,7 +33,7 @@ PLUGIN_LICENSE = 'GPLv3'
 PLUGIN_LICENSE_URL = 'https://www.gnu.org/licenses/gpl-3.0.en.html'
 
 from PyQt5 import QtWidgets
-from picard.config import BoolOption
+from picard.config import BoolOption, TextOption
 from picard import config, log
 from picard.file import File, register_file_post_addition_to_track_processor, register_file_post_load_processor
 from picard.metadata import register_track_metadata_processor
@@ -40,7 +42,66 @@ from picard.track import Track
 from picard.album import Album
 from picard.ui.itemviews import BaseAction, register_file_action, register_track_action, register_album_action
 from picard.ui.options import OptionsPage, register_options_page
-from picard.util import thread
+from picard.plugins.metapicardcommon import AlbumBatch, AuditTrail, FingerprintIndex, Profiler, keyForms, keyFormsAttribute
+
+
+
+_profiler = Profiler(PLUGIN_NAME)
+
+
+
+class _CommentScanner():
+
+    _leading = re.compile(r'^\W*')
+    _hexOnly = re.compile(r'[ 0-9A-F]+', re.IGNORECASE)
+
+    # signatures: (literal, anchored?, regex confirming a match starting where the literal does)
+    def __init__( self, signatures ):
+        self._goto, self._fail, self._outputs = [{}], [0], [[]]
+        self._anywhere = False
+        self._anchoredLength = 0
+        for literal, anchored, confirmation in signatures:
+            literal = literal.casefold()
+            if (not literal): continue
+            state = 0
+            for c in literal:
+                if (c not in self._goto[state]):
+                    self._goto[state][c] = len(self._goto)
+                    self._goto += [{}]
+                    self._fail += [0]
+                    self._outputs += [[]]
+                state = self._goto[state][c]
+            confirmation = re.compile(confirmation, re.IGNORECASE) if confirmation else None
+            self._outputs[state] += [(literal, anchored, confirmation)]
+            if (anchored): self._anchoredLength = max(self._anchoredLength, len(literal))
+            else: self._anywhere = True
+        queue = deque(self._goto[0].values())
+        while (queue):
+            state = queue.popleft()
+            for c, nextState in self._goto[state].items():
+                queue.append(nextState)
+                fail = self._fail[state]
+                while (fail and (c not in self._goto[fail])): fail = self._fail[fail]
+                self._fail[nextState] = self._goto[fail].get(c, 0)
+                self._outputs[nextState] = self._outputs[nextState] + self._outputs[self._fail[nextState]]
+
+    def match( self, value ):
+        if (self._hexOnly.fullmatch(value)): return r'hexadecimal'
+        folded = value.casefold()
+        if (len(folded) != len(value)): folded = r''.join(((c.casefold() if (len(c.casefold()) == 1) else c) for c in value))
+        start = self._leading.match(value).end()
+        end = len(value) if self._anywhere else min(len(value), (start + self._anchoredLength))
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        state = 0
+        for i in range((0 if self._anywhere else start), end):
+            c = folded[i]
+            while (state and (c not in goto[state])): state = fail[state]
+            state = goto[state].get(c, 0)
+            for literal, anchored, confirmation in outputs[state]:
+                begin = i + 1 - len(literal)
+                if (anchored and (begin != start)): continue
+                if ((confirmation is None) or confirmation.match(value, begin)): return literal
+        return None
 
 
 
@@ -78,55 +139,154 @@ class OriginsOblivion( BaseAction ):
 
     _lastfmTargets =  { r'grouping', r'albumgrouping', r'albumgenre', }
 
-    _knownSoftware =  r'exactaudiocopy|easy\W*cd\W*da|eac\W*flac|audiograbber|vsdc|'
-    _knownComments =  _knownSoftware + r'visit\W|download|((https?://)?www\.[\w-]+|https?://[\w.-]+)\.[a-zA-Z]{2,3}'
-    _commentTargets = re.compile(r'^([ 0-9A-F]+|\W*(ripped|encoded|' + _knownComments + ').*)$', re.IGNORECASE)
+    # known software and spam found at the start of comments (besides hexadecimal-only ones)
+    _commentSignatures = [ (r'ripped', True, None), (r'encoded', True, None),
+                           (r'exactaudiocopy', True, None), (r'easy', True, r'easy\W*cd\W*da'),
+                           (r'eac', True, r'eac\W*flac'), (r'audiograbber', True, None), (r'vsdc', True, None),
+                           (r'visit', True, r'visit\W'), (r'download', True, None),
+                           (r'www.', True, r'www\.[\w-]+\.[a-zA-Z]{2,3}'),
+                           (r'http', True, r'https?://(www\.[\w-]+|[\w.-]+)\.[a-zA-Z]{2,3}'), ]
+
+    _options = ( r'purgeMBIDs', r'purgeTrackMBID', r'purgeReleaseMBID', r'purgeDiscogs', r'purgeiTunes',
+                 r'purgeLastFM', r'purgeMusicIP', r'purgeAcoustID', r'commentSignatures', )
+    _fingerprints = FingerprintIndex(PLUGIN_NAME, PLUGIN_VERSION, _options)
+
+    # option: pattern matched at the start of the base key form
+    _optionalPrefixes = { r'purgeDiscogs': r'discogs', r'purgeiTunes': r'itun', r'purgeMusicIP': r'musicip',
+                          r'purgeLastFM': r'\W*last\W?fm', r'purgeAcoustID': r'\W*acoust\W?id', }
+
+    # option: substring searched for in the flattened key form
+    _optionalSubstrings = { r'purgeMusicIP': r'musicip', r'purgeLastFM': r'lastfm', r'purgeAcoustID': r'acoustid', }
+
+    _KEEP, _PURGE, _CHECK = 0, 1, 2
+
+    _predicate = None
+    _predicateFingerprint = None
+    _commentScanner = None
+    _rules = []
+    _auditTrail = None
+    _decisionMemo = {}
+    _decisionMemoLimit = 8192
+    _planMemo = {}
+    _planMemoLimit = 1024
 
     def __init__( self ):
         super().__init__()
 
-    def process( self, album, metadata, track, release ):
-        toBeDeleted = []
-        for key in metadata:
-            normkey = re.sub(r'[^\w_]', r'', re.sub(r'[\s:/_-]+', r'_', key.casefold()))
-            normkey = re.sub(r'^\W*(txxx\W*)?(.+)\W$', r'\2', normkey)
-            if ((config.setting[r'purgeMBIDs'] and (normkey in self._mbidTargets)) or
-                (config.setting[r'purgeTrackMBID'] and (normkey == r'musicbrainz_trackid')) or
-                (config.setting[r'purgeReleaseMBID'] and (normkey == r'musicbrainz_releaseid')) or
-                (config.setting[r'purgeDiscogs'] and normkey.startswith(r'discogs')) or
-                (config.setting[r'purgeiTunes'] and normkey.startswith(r'itun')) or
-                (config.setting[r'purgeMusicIP'] and normkey.startswith(r'musicip')) or
-                (config.setting[r'purgeLastFM'] and re.match(r'^\W*last\W?fm', normkey)) or
-                (config.setting[r'purgeAcoustID'] and re.match(r'^\W*acoust\W?id', normkey)) or
-                (re.match(r'^comment', normkey) and self._commentTargets.match(metadata[key]))):
-                toBeDeleted += [key]
-            normkey = re.sub(r'^\W*(wm|((com\W*)?apple\W*)?itunes|lastfm)\W*', r'', normkey)
-            normkey = re.sub(r'[_~]', r'', normkey)
-            if (normkey in self._defaultTargets):
-                toBeDeleted += [key]
-            else:
-                if ((config.setting[r'purgeiTunes'] and (normkey in self._iTunesTargets)) or
-                    (config.setting[r'purgeMusicIP'] and (r'musicip' in normkey)) or
-                    (config.setting[r'purgeLastFM'] and ((r'lastfm' in normkey) or (normkey in self._lastfmTargets))) or
-                    (config.setting[r'purgeAcoustID'] and (r'acoustid' in normkey))):
-                    toBeDeleted += [key]
-        for tagName in toBeDeleted: metadata.pop(tagName, None)
+    @classmethod
+    def _compilePredicate( cls ):
+        setting = {option: config.setting[option] for option in cls._options}
+        fingerprint = tuple(setting[option] for option in cls._options)
+        if ((cls._predicate is not None) and (fingerprint == cls._predicateFingerprint)): return
+        baseKeys = {key: r'purgeMBIDs' for key in cls._mbidTargets} if setting[r'purgeMBIDs'] else {}
+        if (setting[r'purgeTrackMBID']): baseKeys[r'musicbrainz_trackid'] = r'purgeTrackMBID'
+        if (setting[r'purgeReleaseMBID']): baseKeys[r'musicbrainz_releaseid'] = r'purgeReleaseMBID'
+        flatKeys = {}
+        if (setting[r'purgeiTunes']): flatKeys.update({key: r'purgeiTunes' for key in cls._iTunesTargets})
+        if (setting[r'purgeLastFM']): flatKeys.update({key: r'purgeLastFM' for key in cls._lastfmTargets})
+        flatKeys.update({key: (r'target:' + key) for key in cls._defaultTargets})
+        prefixes = [(option, prefix) for option, prefix in cls._optionalPrefixes.items() if setting[option]]
+        substrings = [(option, part) for option, part in cls._optionalSubstrings.items() if setting[option]]
+        signatures = cls._commentSignatures + cls._userSignatures(setting[r'commentSignatures'])
+        cls._rules = (list(baseKeys.values()) + list(flatKeys.values()) + [(r'prefix:' + option) for option, _ in prefixes] +
+                      [(r'substring:' + option) for option, _ in substrings] + [r'comment:hexadecimal'] +
+                      [(r'comment:' + literal.casefold()) for literal, _, _ in signatures])
+        prefixes = re.compile(r'^(?:' + r'|'.join(r'(?P<{}>{})'.format(*prefix) for prefix in prefixes) + r')') if prefixes else None
+        substrings = re.compile(r'|'.join(r'(?P<{}>{})'.format(*part) for part in substrings)) if substrings else None
+        cls._predicate = (baseKeys, prefixes, flatKeys, substrings)
+        cls._commentScanner = _CommentScanner(signatures)
+        cls._predicateFingerprint = fingerprint
+        cls._decisionMemo = {}
+        cls._planMemo = {}
+
+    @classmethod
+    def _userSignatures( cls, text ):
+        signatures = []
+        for line in text.splitlines():
+            line = line.strip()
+            anchored = line.startswith(r'^')
+            if (anchored): line = line[1:].strip()
+            if (line): signatures += [(line, anchored, None)]
+        return signatures
+
+    @classmethod
+    def _audit( cls ):
+        if (not config.setting[r'auditOriginsOblivion']): return None
+        if (cls._auditTrail is None): cls._auditTrail = AuditTrail(PLUGIN_NAME, (lambda: cls._rules))
+        return cls._auditTrail
+
+    def _decide( self, forms ):
+        base, flat = forms[0], forms[3]
+        baseKeys, prefixes, flatKeys, substrings = self._predicate
+        if (base in baseKeys): return (self._PURGE, baseKeys[base])
+        if (flat in flatKeys): return (self._PURGE, flatKeys[flat])
+        found = prefixes.match(base) if prefixes else None
+        if (found): return (self._PURGE, (r'prefix:' + found.lastgroup))
+        found = substrings.search(flat) if substrings else None
+        if (found): return (self._PURGE, (r'substring:' + found.lastgroup))
+        return (self._CHECK, None) if base.startswith(r'comment') else (self._KEEP, None)
+
+    def _plan( self, keys, f ):
+        knownForms = getattr(f, keyFormsAttribute, None) or {}
+        toBePurged, toBeChecked = [], []
+        for key in keys:
+            decision = self._decisionMemo.get(key, None)
+            if (decision is None):
+                if (len(self._decisionMemo) >= self._decisionMemoLimit): self._decisionMemo.clear()
+                decision = self._decide(knownForms.get(key, None) or keyForms(key))
+                self._decisionMemo[key] = decision
+            if (decision[0] == self._PURGE): toBePurged += [(key, decision[1])]
+            elif (decision[0] == self._CHECK): toBeChecked += [key]
+        return (tuple(toBePurged), tuple(toBeChecked))
+
+    def process( self, album, metadata, track, release, f=None ):
+        audit = self._audit()
+        if (audit):
+            startedAt, sizeBefore, keysBefore = perf_counter(), audit.size(metadata), list(metadata)
+            hits = {}
+        if (self._predicate is None): self._compilePredicate()
+        signature = (frozenset(metadata), self._predicateFingerprint)
+        plan = self._planMemo.get(signature, None)
+        if (plan is None):
+            if (len(self._planMemo) >= self._planMemoLimit): self._planMemo.clear()
+            plan = self._plan(signature[0], f)
+            self._planMemo[signature] = plan
+        toBePurged, toBeChecked = plan
+        for tagName, rule in toBePurged:
+            metadata.pop(tagName, None)
+            if (audit): hits[rule] = hits.get(rule, 0) + 1
+        for tagName in toBeChecked:
+            values = metadata.getall(tagName)
+            kept = []
+            for value in values:
+                signature = self._commentScanner.match(value)
+                if (signature is None): kept += [value]
+                elif (audit): hits[r'comment:' + signature] = hits.get(r'comment:' + signature, 0) + 1
+            if (not kept): metadata.pop(tagName, None)
+            elif (len(kept) != len(values)): metadata[tagName] = kept
+        if (audit): audit.record((perf_counter() - startedAt), hits, sizeBefore, keysBefore, metadata)
 
     def _finish( self, file, result=None, error=None ):
-        pass
+        if (result): AlbumBatch.apply(file, result)
+
+    # replaying a change-set would not feed the audit trail
+    def _processFile( self, hook, track, file ):
+        process = partial(self.process, None, file.metadata, track, None, file)
+        if (self._audit()): process()
+        else: self._fingerprints.run(hook, file, process)
 
     def processFile( self, track, file ):
-        self.process(None, file.metadata, track, None)
+        self._processFile(r'file_post_addition_to_track', track, file)
 
     def processFileOnLoad( self, file ):
-        self.process(None, file.metadata, None, None)
+        self._processFile(r'file_post_load', None, file)
 
     def callback( self, objs ):
         for obj in objs:
             if (isinstance(obj, Track)):
-                for f in obj.linked_files: self.process(None, f.metadata, obj, None)
+                for f in obj.linked_files: self.process(None, f.metadata, obj, None, f)
             elif (isinstance(obj, File)):
-                self.process(None, obj.metadata, None, None)
+                self.process(None, obj.metadata, None, None, obj)
 
 
 
@@ -137,13 +297,17 @@ class OriginsOblivionForAlbums( OriginsOblivion ):
     def __init__( self ):
         super().__init__()
 
+    def _prepareAlbum( self, album ):
+        self._compilePredicate()
+
+    def _processAlbumFile( self, album, track, f, metadata ):
+        self.process(album, metadata, track, None, f)
+
+    def _albumsFinished( self, batch ):
+        pass
+
     def callback( self, objs ):
-        for obj in objs:
-            if (isinstance(obj, Album)):
-                for track in obj.tracks:
-                    for f in track.linked_files:
-                        thread.run_task(partial(super().process, None, f.metadata, obj, None),
-                                partial(super()._finish, f))
+        AlbumBatch(self, [obj for obj in objs if (isinstance(obj, Album))], _profiler).start()
 
 
 
@@ -160,7 +324,9 @@ class OriginsOblivionOptionsPage( OptionsPage ):
                 BoolOption(r'setting', r'purgeiTunes', True),
                 BoolOption(r'setting', r'purgeLastFM', True),
                 BoolOption(r'setting', r'purgeMusicIP', True),
-                BoolOption(r'setting', r'purgeAcoustID', False) ]
+                BoolOption(r'setting', r'purgeAcoustID', False),
+                TextOption(r'setting', r'commentSignatures', r''),
+                BoolOption(r'setting', r'auditOriginsOblivion', False) ]
 
     def __init__( self, parent=None ):
         super().__init__(parent)
@@ -205,6 +371,16 @@ class OriginsOblivionOptionsPage( OptionsPage ):
         self.purgeAcoustID.setChecked(False)
         self.purgeAcoustID.setText(r'Purge AcoustID tags')
         self.box.addWidget(self.purgeAcoustID)
+        self.signaturesLabel = QtWidgets.QLabel(self)
+        self.signaturesLabel.setText(r'Also purge comments containing (one text per line; start it with ^ to match only the beginning)')
+        self.box.addWidget(self.signaturesLabel)
+        self.signaturesInput = QtWidgets.QPlainTextEdit(self)
+        self.box.addWidget(self.signaturesInput)
+        self.auditOriginsOblivion = QtWidgets.QCheckBox(self)
+        self.auditOriginsOblivion.setCheckable(True)
+        self.auditOriginsOblivion.setChecked(False)
+        self.auditOriginsOblivion.setText(r'Keep an audit trail of the tags purged (in the cache directory)')
+        self.box.addWidget(self.auditOriginsOblivion)
         self.spacer = QtWidgets.QSpacerItem(0, 0, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         self.box.addItem(self.spacer)
 
@@ -212,28 +388,33 @@ class OriginsOblivionOptionsPage( OptionsPage ):
         self.purgeMBIDs.setChecked(config.setting[r'purgeMBIDs'])
         self.purgeTrackMBID.setChecked(config.setting[r'purgeTrackMBID'])
         self.purgeReleaseMBID.setChecked(config.setting[r'purgeReleaseMBID'])
-        self.purgeiTunes.setChecked(config.setting[r'purgeDiscogs'])
+        self.purgeDiscogs.setChecked(config.setting[r'purgeDiscogs'])
         self.purgeiTunes.setChecked(config.setting[r'purgeiTunes'])
         self.purgeLastFM.setChecked(config.setting[r'purgeLastFM'])
         self.purgeMusicIP.setChecked(config.setting[r'purgeMusicIP'])
         self.purgeAcoustID.setChecked(config.setting[r'purgeAcoustID'])
+        self.signaturesInput.setPlainText(config.setting[r'commentSignatures'])
+        self.auditOriginsOblivion.setChecked(config.setting[r'auditOriginsOblivion'])
 
     def save( self ):
         config.setting[r'purgeMBIDs'] = self.purgeMBIDs.isChecked()
         config.setting[r'purgeTrackMBID'] = self.purgeTrackMBID.isChecked()
         config.setting[r'purgeReleaseMBID'] = self.purgeReleaseMBID.isChecked()
-        config.setting[r'purgeDiscogs'] = self.purgeiTunes.isChecked()
+        config.setting[r'purgeDiscogs'] = self.purgeDiscogs.isChecked()
         config.setting[r'purgeiTunes'] = self.purgeiTunes.isChecked()
         config.setting[r'purgeLastFM'] = self.purgeLastFM.isChecked()
         config.setting[r'purgeMusicIP'] = self.purgeMusicIP.isChecked()
         config.setting[r'purgeAcoustID'] = self.purgeAcoustID.isChecked()
+        config.setting[r'commentSignatures'] = self.signaturesInput.toPlainText()
+        config.setting[r'auditOriginsOblivion'] = self.auditOriginsOblivion.isChecked()
+        OriginsOblivion._compilePredicate()
 
 
 
-register_file_action(OriginsOblivion())
-register_file_post_addition_to_track_processor(OriginsOblivion().processFile, priority=PluginPriority.LOW)
-register_file_post_load_processor(OriginsOblivion().processFileOnLoad)
+register_file_action(_profiler.action(r'file_action', OriginsOblivion()))
+register_file_post_addition_to_track_processor(_profiler.wrap(r'file_post_addition_to_track', OriginsOblivion().processFile), priority=PluginPriority.LOW)
+register_file_post_load_processor(_profiler.wrap(r'file_post_load', OriginsOblivion().processFileOnLoad))
 # register_track_action(OriginsOblivion())
 # register_track_metadata_processor(OriginsOblivion().process)
-register_album_action(OriginsOblivionForAlbums())
+register_album_action(_profiler.action(r'album_action', OriginsOblivionForAlbums()))
 register_options_page(OriginsOblivionOptionsPage)
@@ -32,15 +32,19 @@ PLUGIN_LICENSE = 'GPLv3'
 PLUGIN_LICENSE_URL = 'https://www.gnu.org/licenses/gpl-3.0.en.html'
 
 from PyQt5 import QtWidgets
-from picard.config import BoolOption
+from picard.config import BoolOption, TextOption
 from picard import config, log
 from picard.file import File, register_file_post_addition_to_track_processor
-from picard.metadata import register_track_metadata_processor
+from picard.metadata import Metadata, register_track_metadata_processor
 from picard.track import Track
 from picard.album import Album
 from picard.ui.itemviews import BaseAction, register_file_action, register_track_action, register_album_action
 from picard.ui.options import OptionsPage, register_options_page
-from picard.util import thread
+from picard.plugins.metapicardcommon import AlbumBatch, FingerprintIndex, Profiler, keyForms, keyFormsAttribute
+
+
+
+_profiler = Profiler(PLUGIN_NAME)
 
 
 
@@ -131,49 +135,123 @@ class SuperComment( BaseAction ):
     _alternativeLabelTags = { r'label', r'labelcode', r'recordlabel', r'tpub', r'distributedby',
                               r'company', r'recordcompany', r'organization', r'publisher',
                               r'publishedby', r'publishingcompany', r'distributor', r'corporation', }
+    _labelTagMemo = {}
+    _labelTagMemoLimit = 4096
+
+    _nonWord = re.compile(r'\W')
+    _unknownLabel = re.compile(r'^(unknown|undefined|notinformed|missing|na)?$')
+    _independentLabel = r'^(selfreleased?|autonomous(release)?|no(ton)?label|ind(ie|ependente?)|none|'
+    _independentLabel = re.compile(_independentLabel + r'artist|selfpublished)$')
+    _noCatalogNumber = re.compile(r'^\W*(n(one|ull|\W*a)\W*)?$', re.IGNORECASE)
+    _gluedSlash = re.compile(r'([^\s])/([^\s])')
+    _companyMemo = {}
+    _companyMemoLimit = 1024
+
+    _fileFormats = r'[af]lac|w(a?vpack|m[av])|pcm|ape|m(4[abpv]|p[c+34]|k[av]|atroska)|lossless\W*audio'
+    _fileSources = r'spotify|deezer|itunes|bandcamp|.*download.*|torrent|soundcloud|youtube|livemotion|'
+    _fileSources += r'a(pple|mazon)(\W*music)?|vimeo|torrent|tidal|napster|google\W*((play\W*)?music|play)|myspace'
+    _digital = r'(files?|' + _fileFormats + r'|' + _fileSources + r'|og[agmv](\W*vorbis)?|windows\W*media)\W.*'
+    _digital = re.compile(r'^\W*(dig\W*|' + _digital + r')$')
+    _parenthesized = re.compile(r'[\s_]*\([^)]\)')
+    _spacing = re.compile(r'[\s_]+')
+    _quotes = re.compile("(''" + r'|["ˮ“”‟❝❞〞〝＂])')
+    _apostrophes = re.compile(r'[´`’ʼʹʻʽˈˊʹ՚᾽᾿‘‛′‵＇]')
+    _vinyl = re.compile(r'(([0-9,.]+)(")[\s-]*)?(vinyl|shellac|flexi[\s-]*dis[ck]|floppy|laser[ -]?dis[ck])')
+    _cassette = re.compile(r'.*(micro)?[ -]*cassette.*')
+    _dvd = re.compile(r'(hd[ -]*)?dvd([ -]?(audio|video|plus))?')
+    _bluray = re.compile(r'.*(blu[ -]*ray)([ -]*r)?.*')
+    _compactDisc = re.compile(r'compact( |-*)dis[ck]')
+    _cd = re.compile(r'(8 ?cm|blu[ -]*spec|copy[ -]*control|data|dts|enhanced|s?v|h[dq]|shm)?[ -]*cd(\+?g|-?r|v)?')
+    _otherMedia = r'.*(betamax|cartridge|(music|sd)[ -]*card|path.[ -]*disc|piano[ -]*roll|'
+    _otherMedia += r'wax cylinder|wire recording|([48][ -]*|multi)tracks[ -]*record(ing)?|vinyldis[ck]|'
+    _otherMedia += r'playbutton|(dual|mini)[ -]*dis[ck]|zip[ -]*dis[ck]|playtape|hipac|tefifon|'
+    _otherMedia += r'elcaset|edison|(shm[ -]*)?sacd|hybrid[ -]*sacd|reel[ -]*to[ -]*reel|slotmusic|'
+    _otherMedia = re.compile(_otherMedia + r'usb[ -]+|ced|dat|dcc|umd|vh[ds]|gramophone[ -]record(ing)?).*')
+    _otherSeparators = re.compile(r'[ -]+')
+    _justUpper = {r'ced', r'dat', r'dcc', r'umd', r'vhd', r'vhs', r'sacd'}
+    _otherNames = { r'playtape':r'PlayTape', r'betamax':r'Betamax', r'playbutton':r'Playbutton',
+                    r'hipac':r'HiPac', r'reeltoreel':r'reel-to-reel', r'tefifon':r'Tefifon',
+                    r'slotmusic':r'slotMusic', r'elcaset':r'Elcaset', r'edison':r'Edison disc' }
+
+    _formatMemo = {}
+    _formatMemoLimit = 512
+
+    # tags read or rewritten by _company, _what and _whereAndWhen (all release-level)
+    _releaseTags = ( r'label', r'company', r'catalognumber', r'albumartist', r'~albumartists', r'totaldiscs',
+                     r'media', r'releasestatus', r'releasetype', r'~primaryreleasetype', r'~secondaryreleasetype',
+                     r'compilation', r'album', r'~releasegroup', r'~totalalbumtracks', r'totaltracks', r'djmixer',
+                     r'date', r'originalyear', r'originaldate', r'Original Year', r'~recording_firstreleasedate',
+                     r'~releasegroup_firstreleasedate', r'releasecountry', r'~releasecountries', )
+
+    _factsMemo = {}
+    _factsMemoLimit = 256
+
+    _defaultTemplate = r'{company}{what}{whereandwhen}{barcode}{isrc}{asin}{discid}'
+    _templateOptions = ( r'commentTemplate', r'includeBarcode', r'includeISRC', r'includeASIN', r'includeDiscID', r'removeMBIDs', )
+    _fingerprints = FingerprintIndex(PLUGIN_NAME, PLUGIN_VERSION, (_templateOptions + (r'appendReleaseTypeToAlbum',)))
+    _templateFields = re.compile(r'(\{\w+\})')
+    _releaseFields = {r'company': 0, r'what': 1, r'whereandwhen': 2}
+    # field: (option, tag, label, junk, upper)
+    _codeFields = { r'barcode': (r'includeBarcode', r'barcode', r'barcode', re.compile(r'[^0-9]'), False),
+                    r'isrc':    (r'includeISRC', r'isrc', r'ISRC', re.compile(r'[^0-9A-Z]'), True),
+                    r'asin':    (r'includeASIN', r'asin', r'ASIN', re.compile(r'[^0-9A-Z]'), True),
+                    r'discid':  (r'includeDiscID', r'discid', r'disc ID', re.compile(r'\s+'), True), }
+    _mbidTags = ( r'musicbrainz_albumid', r'musicbrainz_discid', r'musicbrainz_originalalbumid',
+                  r'musicbrainz_releasegroupid', r'musicbrainz_recordingid', r'musicbrainz_albumartistid', )
+    _template = None
+    _templateFingerprint = None
 
     def __init__( self ):
         super().__init__()
 
-    def _isIndependent( self, company, metadata ):
-        unknown = re.compile(r'^(unknown|undefined|notinformed|missing|na)?$')
-        independent = r'^(selfreleased?|autonomous(release)?|no(ton)?label|ind(ie|ependente?)|none|'
-        independent = re.compile(independent + r'artist|selfpublished)$')
-        normcompany = re.sub(r'\W', r'', company).casefold()
-        if (unknown.match(normcompany)): return False
-        albumartist = metadata.get(r'albumartist', metadata.get(r'~albumartists', r''))
-        normartist = re.sub(r'\W', r'', albumartist).casefold()
-        if (unknown.match(albumartist)): return False
-        if (independent.match(normcompany) or (normcompany == normartist)): return True
+    def _isLabelTag( self, tagName, knownForms ):
+        isLabel = self._labelTagMemo.get(tagName, None)
+        if (isLabel is None):
+            if (len(self._labelTagMemo) >= self._labelTagMemoLimit): self._labelTagMemo.clear()
+            isLabel = ((knownForms.get(tagName, None) or keyForms(tagName))[4] in self._alternativeLabelTags)
+            self._labelTagMemo[tagName] = isLabel
+        return isLabel
+
+    def _isIndependent( self, company, albumartist, normartist ):
+        normcompany = self._nonWord.sub(r'', company).casefold()
+        if (self._unknownLabel.match(normcompany)): return False
+        if (self._unknownLabel.match(albumartist)): return False
+        if (self._independentLabel.match(normcompany) or (normcompany == normartist)): return True
         return False
 
-    def _company( self, metadata ):
-        company = metadata.get(r'label', metadata.get(r'company', r'')).strip()
-        labelTags = []
-        for tagName in metadata:
-            if (re.sub(r'\W', r'', tagName).casefold() in self._alternativeLabelTags):
-                if (not company): company = metadata[tagName].strip()
-                labelTags += [tagName]
-        for tagName in labelTags: metadata.pop(tagName, None)
-        catalogNumber = metadata.get(r'catalognumber', r'').strip()
-        metadata.pop(r'catalognumber', None)
-        if (self._isIndependent(company, metadata)): return r'independent;'
+    def _companyFragment( self, company, catalogNumber, albumartist ):
+        normartist = self._nonWord.sub(r'', albumartist).casefold()
+        if (self._isIndependent(company, albumartist, normartist)): return r'independent;'
         company = [entry.strip() for entry in company.split(r';')]
         if (len(company) == 1): company = [entry.strip() for entry in company[0].split(r' / ')]
-        company = [entry for entry in company if (not re.match(r'^\s*$', entry))]
+        company = [entry for entry in company if (len(entry))]
         for i, entry in enumerate(company):
-            if (self._isIndependent(entry, metadata)): company[i] = r'independent';
-        company = re.sub(r'([^\s])/([^\s])', r'\1 / \2', r' / '.join(company)).strip()
+            if (self._isIndependent(entry, albumartist, normartist)): company[i] = r'independent';
+        company = self._gluedSlash.sub(r'\1 / \2', r' / '.join(company)).strip()
         catalogNumber = [entry.strip() for entry in catalogNumber.split(r';')]
         if (len(catalogNumber) == 1):
             catalogNumber = [entry.strip() for entry in catalogNumber[0].split(r' / ')]
-        noneCN = re.compile(r'^\W*(n(one|ull|\W*a)\W*)?$', re.IGNORECASE)
-        catalogNumber = [entry for entry in catalogNumber if (not noneCN.match(entry))]
-        catalogNumber = re.sub(r'([^\s])/([^\s])', r'\1 / \2', r' / '.join(catalogNumber)).strip()
+        catalogNumber = [entry for entry in catalogNumber if (not self._noCatalogNumber.match(entry))]
+        catalogNumber = self._gluedSlash.sub(r'\1 / \2', r' / '.join(catalogNumber)).strip()
         if (not company): return r'?;'
         elif (len(catalogNumber)): return (company + r' (' + catalogNumber + r');')
         else: return (company + r';')
 
+    def _company( self, metadata, labelTags ):
+        company = metadata.get(r'label', metadata.get(r'company', r'')).strip()
+        for tagName in labelTags:
+            if (not company): company = metadata[tagName].strip()
+            metadata.pop(tagName, None)
+        catalogNumber = metadata.get(r'catalognumber', r'').strip()
+        metadata.pop(r'catalognumber', None)
+        signature = (company, catalogNumber, metadata.get(r'albumartist', metadata.get(r'~albumartists', r'')))
+        fragment = self._companyMemo.get(signature, None)
+        if (fragment is None):
+            if (len(self._companyMemo) >= self._companyMemoLimit): self._companyMemo.clear()
+            fragment = self._companyFragment(*signature)
+            self._companyMemo[signature] = fragment
+        return fragment
+
     def _formatWithInches( self, x ):
         inches = x.group(2)
         if (not inches): inches = r''
@@ -214,13 +292,9 @@ class SuperComment( BaseAction ):
         else: return (re.sub(r'[ -]*', r'', prefix) + r' CD' + suffix)
 
     def _formatOther( self, x ):
-        justUpper = {r'ced', r'dat', r'dcc', r'umd', r'vhd', r'vhs', r'sacd'}
-        mapping = { r'playtape':r'PlayTape', r'betamax':r'Betamax', r'playbutton':r'Playbutton',
-                    r'hipac':r'HiPac', r'reeltoreel':r'reel-to-reel', r'tefifon':r'Tefifon',
-                    r'slotmusic':r'slotMusic', r'elcaset':r'Elcaset', r'edison':r'Edison disc' }
-        what = re.sub(r'[ -]+', r'', x.group(1))
-        if (what in justUpper): return what.upper()
-        if (what in mapping): return mapping[what]
+        what = self._otherSeparators.sub(r'', x.group(1))
+        if (what in self._justUpper): return what.upper()
+        if (what in self._otherNames): return self._otherNames[what]
         if (what.startswith(r'vinyldis')): return r'VinylDisc'
         if (what.startswith(r'sd')): return r'SD card'
         if (what.startswith(r'usb')): return r'USB flash drive'
@@ -232,34 +306,28 @@ class SuperComment( BaseAction ):
         if (what.startswith(r'path')): return r'Pathé disc'
         return what
 
-    def _format( self, what ):
+    def _formatUncached( self, what ):
         if ((r'other' in what) or (not what)): return r''
-        fileFormats = r'[af]lac|w(a?vpack|m[av])|pcm|ape|m(4[abpv]|p[c+34]|k[av]|atroska)|lossless\W*audio'
-        fileSources = r'spotify|deezer|itunes|bandcamp|.*download.*|torrent|soundcloud|youtube|livemotion|'
-        fileSources = r'a(pple|mazon)(\W*music)?|vimeo|torrent|tidal|napster|google\W*((play\W*)?music|play)|myspace'
-        digital = r'(files?|' + fileFormats + r'|' + fileSources + '|og[agmv](\W*vorbis)?|windows\W*media)\W.*'
-        if ((r'digital' in what) or re.match((r'^\W*(dig\W*|' + digital + ')$'), what)): return r'digital'
-        what = re.sub(r'[\s_]+', r' ', re.sub(r'[\s_]*\([^)]\)', r'', what))
-        what = re.sub(r'[´`’ʼʹʻʽˈˊʹ՚᾽᾿‘‛′‵＇]', "'", re.sub(("(''" + r'|["ˮ“”‟❝❞〞〝＂])'), r'"', what))
-        vinyl = re.compile(r'(([0-9,.]+)(")[\s-]*)?(vinyl|shellac|flexi[\s-]*dis[ck]|floppy|laser[ -]?dis[ck])')
-        if (vinyl.match(what)): return vinyl.sub(self._formatWithInches, what)
-        cassette = re.compile(r'.*(micro)?[ -]*cassette.*')
-        if (cassette.match(what)): return cassette.sub(r'\1cassette', what)
-        dvd = re.compile(r'(hd[ -]*)?dvd([ -]?(audio|video|plus))?')
-        if (dvd.match(what)): return dvd.sub(self._formatDVD, what)
-        bluray = re.compile(r'.*(blu[ -]*ray)([ -]*r)?.*')
-        if (bluray.match(what)): return bluray.sub(self._formatBluRay, what)
-        what = re.sub(r'compact( |-*)dis[ck]', r'cd', what)
-        cd = re.compile(r'(8 ?cm|blu[ -]*spec|copy[ -]*control|data|dts|enhanced|s?v|h[dq]|shm)?[ -]*cd(\+?g|-?r|v)?')
-        if (cd.match(what)): return cd.sub(self._formatCD, what)
-        other = r'.*(betamax|cartridge|(music|sd)[ -]*card|path.[ -]*disc|piano[ -]*roll|'
-        other += r'wax cylinder|wire recording|([48][ -]*|multi)tracks[ -]*record(ing)?|vinyldis[ck]|'
-        other += r'playbutton|(dual|mini)[ -]*dis[ck]|zip[ -]*dis[ck]|playtape|hipac|tefifon|'
-        other += r'elcaset|edison|(shm[ -]*)?sacd|hybrid[ -]*sacd|reel[ -]*to[ -]*reel|slotmusic|'
-        other = re.compile(other + r'usb[ -]+|ced|dat|dcc|umd|vh[ds]|gramophone[ -]record(ing)?).*')
-        if (other.match(what)): return other.sub(self._formatOther, what)
+        if ((r'digital' in what) or self._digital.match(what)): return r'digital'
+        what = self._spacing.sub(r' ', self._parenthesized.sub(r'', what))
+        what = self._apostrophes.sub("'", self._quotes.sub(r'"', what))
+        if (self._vinyl.match(what)): return self._vinyl.sub(self._formatWithInches, what)
+        if (self._cassette.match(what)): return self._cassette.sub(r'\1cassette', what)
+        if (self._dvd.match(what)): return self._dvd.sub(self._formatDVD, what)
+        if (self._bluray.match(what)): return self._bluray.sub(self._formatBluRay, what)
+        what = self._compactDisc.sub(r'cd', what)
+        if (self._cd.match(what)): return self._cd.sub(self._formatCD, what)
+        if (self._otherMedia.match(what)): return self._otherMedia.sub(self._formatOther, what)
         return r''
 
+    def _format( self, what ):
+        formatted = self._formatMemo.get(what, None)
+        if (formatted is None):
+            if (len(self._formatMemo) >= self._formatMemoLimit): self._formatMemo.clear()
+            formatted = self._formatUncached(what)
+            self._formatMemo[what] = formatted
+        return formatted
+
     def _generateAlbumFormatTag( self, album ):
         albumFormat = {}
         lastDiscNumber = 0
@@ -334,11 +402,18 @@ class SuperComment( BaseAction ):
             return
         metadata[r'album'] = album
 
+    # computed on the main thread (album batches do it before starting any worker), where it is
+    # kept as an attribute of the album until its metadata is replaced; workers only read it
+    def _albumFormat( self, album, store=False ):
+        cached = getattr(album, r'superCommentFormat', None)
+        if ((cached is not None) and (cached[0] is album.metadata)): return cached[1]
+        albumFormat = self._generateAlbumFormatTag(album)
+        if (store): album.superCommentFormat = (album.metadata, albumFormat)
+        return albumFormat
+
     def _what( self, metadata, album ):
         if (album and (int(metadata.get(r'totaldiscs', r'0')) != 1)):
-            if (not album.metadata.get(r'~supercomment_format', None)):
-                album.metadata[r'~supercomment_format'] = self._generateAlbumFormatTag(album)
-            what = album.metadata[r'~supercomment_format']
+            what = self._albumFormat(album)
         else:
             what = self._format(metadata.get(r'media', r'').casefold().strip())
         metadata.pop(r'media', None)
@@ -409,52 +484,98 @@ class SuperComment( BaseAction ):
         elif (len(where)): return  (r' ' + where + r' - ?;')
         else: return r' ?;'
 
-    def process( self, album, metadata, track, release ):
-        comment = self._company(metadata)
-        comment += self._what(metadata, (track.album if track else None))
-        comment += self._whereAndWhen(metadata, (track.album if track else None))
+    def _factsCache( self, album ):
+        if (not album): return self._factsMemo
+        cache = getattr(album, r'superCommentFacts', None)
+        if ((cache is None) or (cache[0] is not album.metadata)):
+            cache = (album.metadata, {})
+            album.superCommentFacts = cache
+        return cache[1]
+
+    def _releaseFacts( self, metadata, knownForms, album ):
+        labelTags = tuple(tagName for tagName in metadata if (self._isLabelTag(tagName, knownForms)))
+        inputs = tuple(tagName for tagName in (self._releaseTags + labelTags) if (tagName in metadata))
+        fingerprint = (metadata.get(r'musicbrainz_albumid', r''), config.setting[r'appendReleaseTypeToAlbum'],
+                       (None if album else (metadata.length // 60000)),
+                       tuple((tagName, tuple(metadata.getall(tagName))) for tagName in inputs))
+        cache = self._factsCache(album)
+        facts = cache.get(fingerprint, None)
+        if (facts is None):
+            scratch = Metadata()
+            for tagName in inputs: scratch[tagName] = metadata.getall(tagName)
+            scratch.length = metadata.length
+            fragments = ( self._company(scratch, labelTags),
+                          self._what(scratch, album), self._whereAndWhen(scratch, album), )
+            changes = {tagName: scratch.getall(tagName) for tagName in scratch
+                       if (scratch.getall(tagName) != metadata.getall(tagName))}
+            deletions = tuple(tagName for tagName in inputs if (tagName not in scratch))
+            facts = (fragments, changes, deletions)
+            if ((not album) and (len(cache) >= self._factsMemoLimit)): cache.clear()
+            cache[fingerprint] = facts
+        return facts
+
+    @staticmethod
+    def _codeSegment( tagName, label, junk, upper ):
+        def segment( metadata, fragments ):
+            value = metadata.get(tagName, r'')
+            if (upper): value = value.upper()
+            return (r' ' + label + r': ' + junk.sub(r'', value) + r',') if (len(value)) else r''
+        return segment
+
+    @classmethod
+    def _compileTemplate( cls ):
+        setting = {option: config.setting[option] for option in cls._templateOptions}
+        fingerprint = tuple(setting[option] for option in cls._templateOptions)
+        if ((cls._template is not None) and (fingerprint == cls._templateFingerprint)): return
+        segments = []
+        for part in cls._templateFields.split(setting[r'commentTemplate'] or cls._defaultTemplate):
+            field = part[1:-1].casefold() if (cls._templateFields.fullmatch(part)) else None
+            if (field in cls._releaseFields):
+                segments += [partial((lambda index, metadata, fragments: fragments[index]), cls._releaseFields[field])]
+            elif (field in cls._codeFields):
+                option, tagName, label, junk, upper = cls._codeFields[field]
+                if (setting[option]): segments += [cls._codeSegment(tagName, label, junk, upper)]
+            elif (len(part)):
+                if (field is not None): log.warning(r'{}: unknown comment template field "{}"'.format(PLUGIN_NAME, part))
+                segments += [partial((lambda text, metadata, fragments: text), part)]
+        removals = tuple(code[1] for code in cls._codeFields.values())
+        if (setting[r'removeMBIDs']): removals += cls._mbidTags
+        cls._template = (tuple(segments), removals)
+        cls._templateFingerprint = fingerprint
+
+    def process( self, album, metadata, track, release, f=None ):
+        if (self._template is None): self._compileTemplate()
+        segments, removals = self._template
+        fragments, changes, deletions = self._releaseFacts(metadata, (getattr(f, keyFormsAttribute, None) or {}), (track.album if track else None))
+        for tagName in deletions: metadata.pop(tagName, None)
+        for tagName, values in changes.items(): metadata[tagName] = values
         metadata.pop(r'script', None) # release-related, since it is about the tracklist's script
-        if (config.setting[r'includeBarcode']):
-            barcode = metadata.get(r'barcode', r'')
-            if (len(barcode)): comment += (r' barcode: ' + re.sub(r'[^0-9]', r'', barcode) + r',')
-        metadata.pop(r'barcode', None)
-        if (config.setting[r'includeISRC']):
-            isrc = metadata.get(r'isrc', r'')
-            if (len(isrc)): comment += (r' ISRC: ' + re.sub(r'[^0-9]', r'', isrc) + r',')
-        metadata.pop(r'isrc', None)
-        if (config.setting[r'includeASIN']):
-            asin = metadata.get(r'asin', r'').upper()
-            if (len(asin)): comment += (r' ASIN: ' + re.sub(r'[^0-9A-Z]', r'', asin) + r',')
-        metadata.pop(r'asin', None)
-        if (config.setting[r'includeDiscID']):
-            discid = metadata.get(r'discid', r'').upper()
-            if (len(discid)): comment += (r' disc ID: ' + re.sub(r'\s+', r'', discid) + r',')
-        metadata.pop(r'discid', None)
-        if (config.setting[r'removeMBIDs']):
-            metadata.pop(r'musicbrainz_albumid', None)
-            metadata.pop(r'musicbrainz_discid', None)
-            metadata.pop(r'musicbrainz_originalalbumid', None)
-            metadata.pop(r'musicbrainz_releasegroupid', None)
-            metadata.pop(r'musicbrainz_recordingid', None)
-            metadata.pop(r'musicbrainz_albumartistid', None)
-            metadata.pop(r'musicbrainz_discid', None)
+        comment = r''.join(segment(metadata, fragments) for segment in segments)
+        for tagName in removals: metadata.pop(tagName, None)
         metadata.pop(r'comment:', None)
         metadata.pop(r'Comment', None)
         metadata.pop(r'Comment:', None)
         metadata[r'comment'] = re.sub(r'[,;]$', r'', re.sub(r'\s+', r' ', comment.strip()))
 
     def _finish( self, file, result=None, error=None ):
-        pass
+        if (result): AlbumBatch.apply(file, result)
+
+    # what the album contributes to a file's comment besides the file's own tags
+    def _albumContext( self, album ):
+        if (not album): return None
+        return (self._albumFormat(album, store=True), len(album.tracks), album.metadata.length, album.metadata.get(r'media', r''))
 
     def processFile( self, track, file ):
-        self.process(None, file.metadata, track, None)
+        self._fingerprints.run(r'file_post_addition_to_track', file, partial(self.process, None, file.metadata, track, None, file),
+                               self._albumContext(track.album if track else None))
 
     def callback( self, objs ):
+        self._compileTemplate()
         for obj in objs:
             if (isinstance(obj, Track)):
-                for f in obj.linked_files: self.process(None, f.metadata, obj, None)
+                for f in obj.linked_files: self.process(None, f.metadata, obj, None, f)
             elif (isinstance(obj, File)):
-                self.process(None, obj.metadata, None, None)
+                self.process(None, obj.metadata, None, None, obj)
 
 
 
@@ -465,13 +586,19 @@ class SupperCommentForAlbums( SuperComment ):
     def __init__( self ):
         super().__init__()
 
+    def _prepareAlbum( self, album ):
+        self._compileTemplate()
+        self._factsCache(album)
+        album.superCommentFormat = (album.metadata, self._generateAlbumFormatTag(album))
+
+    def _processAlbumFile( self, album, track, f, metadata ):
+        self.process(album, metadata, track, None, f)
+
+    def _albumsFinished( self, batch ):
+        pass
+
     def callback( self, objs ):
-        for obj in objs:
-            if (isinstance(obj, Album)):
-                for track in obj.tracks:
-                    for f in track.linked_files:
-                        thread.run_task(partial(super().process, None, f.metadata, obj, None),
-                                partial(super()._finish, f))
+        AlbumBatch(self, [obj for obj in objs if (isinstance(obj, Album))], _profiler).start()
 
 
 
@@ -483,10 +610,11 @@ class SuperCommentOptionsPage( OptionsPage ):
 
     options = [ BoolOption(r'setting', r'appendReleaseTypeToAlbum', True),
                 BoolOption(r'setting', r'includeBarcode', True),
-                # BoolOption(r'setting', r'includeISRC', False),
+                BoolOption(r'setting', r'includeISRC', False),
                 BoolOption(r'setting', r'includeASIN', False),
                 BoolOption(r'setting', r'includeDiscID', False),
-                BoolOption(r'setting', r'removeMBIDs', True) ]
+                BoolOption(r'setting', r'removeMBIDs', True),
+                TextOption(r'setting', r'commentTemplate', SuperComment._defaultTemplate) ]
 
     def __init__( self, parent=None ):
         super().__init__(parent)
@@ -501,11 +629,11 @@ class SuperCommentOptionsPage( OptionsPage ):
         self.includeBarcode.setChecked(True)
         self.includeBarcode.setText(r'Include barcode into the generated comment (when available)')
         self.box.addWidget(self.includeBarcode)
-        # self.includeISRC = QtWidgets.QCheckBox(self)
-        # self.includeISRC.setCheckable(True)
-        # self.includeISRC.setChecked(False)
-        # self.includeISRC.setText(r'Include ISRC into the generated comment (when available)')
-        # self.box.addWidget(self.includeISRC)
+        self.includeISRC = QtWidgets.QCheckBox(self)
+        self.includeISRC.setCheckable(True)
+        self.includeISRC.setChecked(False)
+        self.includeISRC.setText(r'Include ISRC into the generated comment (when available)')
+        self.box.addWidget(self.includeISRC)
         self.includeASIN = QtWidgets.QCheckBox(self)
         self.includeASIN.setCheckable(True)
         self.includeASIN.setChecked(False)
@@ -521,30 +649,39 @@ class SuperCommentOptionsPage( OptionsPage ):
         self.removeMBIDs.setChecked(True)
         self.removeMBIDs.setText(r'Remove related MBIDs (not included in the generated comment in either way)')
         self.box.addWidget(self.removeMBIDs)
+        self.templateLabel = QtWidgets.QLabel(self)
+        self.templateLabel.setText(r'Comment template ({company}, {what}, {whereandwhen}, {barcode}, {isrc}, {asin} and {discid} are replaced)')
+        self.box.addWidget(self.templateLabel)
+        self.templateInput = QtWidgets.QLineEdit(self)
+        self.templateInput.setText(SuperComment._defaultTemplate)
+        self.box.addWidget(self.templateInput)
         self.spacer = QtWidgets.QSpacerItem(0, 0, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         self.box.addItem(self.spacer)
 
     def load( self ):
         self.appendReleaseTypeToAlbum.setChecked(config.setting[r'appendReleaseTypeToAlbum'])
         self.includeBarcode.setChecked(config.setting[r'includeBarcode'])
-        # self.includeISRC.setChecked(config.setting[r'includeISRC'])
+        self.includeISRC.setChecked(config.setting[r'includeISRC'])
         self.includeASIN.setChecked(config.setting[r'includeASIN'])
         self.includeDiscID.setChecked(config.setting[r'includeDiscID'])
         self.removeMBIDs.setChecked(config.setting[r'removeMBIDs'])
+        self.templateInput.setText(config.setting[r'commentTemplate'])
 
     def save( self ):
         config.setting[r'appendReleaseTypeToAlbum'] = self.appendReleaseTypeToAlbum.isChecked()
         config.setting[r'includeBarcode'] = self.includeBarcode.isChecked()
-        # config.setting[r'includeISRC'] = self.includeISRC.isChecked()
+        config.setting[r'includeISRC'] = self.includeISRC.isChecked()
         config.setting[r'includeASIN'] = self.includeASIN.isChecked()
         config.setting[r'includeDiscID'] = self.includeDiscID.isChecked()
         config.setting[r'removeMBIDs'] = self.removeMBIDs.isChecked()
+        config.setting[r'commentTemplate'] = self.templateInput.text()
+        SuperComment._compileTemplate()
 
 
 
-register_file_action(SuperComment())
-register_file_post_addition_to_track_processor(SuperComment().processFile)
+register_file_action(_profiler.action(r'file_action', SuperComment()))
+register_file_post_addition_to_track_processor(_profiler.wrap(r'file_post_addition_to_track', SuperComment().processFile))
 # register_track_action(SuperComment())
 # register_track_metadata_processor(SuperComment().process)
-register_album_action(SupperCommentForAlbums())
+register_album_action(_profiler.action(r'album_action', SupperCommentForAlbums()))
 register_options_page(SuperCommentOptionsPage)